@@ -0,0 +1,231 @@
+// Deterministic polygon clipping workloads, reporting their throughput as JSON so versions, profiles and patches of
+// clipper can be compared. Usage: benchmark [repetitions] [scale] [output.json]
+
+#include "polyclipping/clipper.hpp"
+
+#include <algorithm>
+#include <chrono>
+#include <cmath>
+#include <cstdint>
+#include <cstdlib>
+#include <fstream>
+#include <functional>
+#include <iostream>
+#include <random>
+#include <sstream>
+#include <string>
+#include <vector>
+
+using namespace ClipperLib;
+
+#if CLIPPER_MAJOR_VERSION == 6
+
+using Poly = Path;
+using Polys = Paths;
+
+static void addPolys(Clipper& clipper, const Polys& polys, PolyType type)
+{
+    clipper.AddPaths(polys, type, true);
+}
+
+static void offsetPolys(const Polys& in, Polys& out, double delta)
+{
+    ClipperOffset offset;
+    offset.AddPaths(in, jtMiter, etClosedPolygon);
+    offset.Execute(out, delta);
+}
+
+#else
+
+using Poly = Polygon;
+using Polys = Polygons;
+
+static void addPolys(Clipper& clipper, const Polys& polys, PolyType type)
+{
+    clipper.AddPolygons(polys, type);
+}
+
+static void offsetPolys(const Polys& in, Polys& out, double delta)
+{
+    OffsetPolygons(in, out, delta, jtMiter);
+}
+
+#endif
+
+static const double pi = 3.14159265358979323846;
+
+// std::mt19937_64 produces the same sequence on every platform, unlike the standard distributions
+class Random
+{
+public:
+    explicit Random(std::uint64_t seed) : engine_(seed) {}
+
+    long long range(long long min, long long max)
+    {
+        return min + static_cast<long long>(engine_() % static_cast<std::uint64_t>(max - min + 1));
+    }
+
+private:
+    std::mt19937_64 engine_;
+};
+
+// Coordinates are in microns, like CuraEngine, a jittered circle approximates the outline of a printed part
+static Poly jitteredCircle(Random& random, long long cx, long long cy, long long radius, int vertices, long long jitter)
+{
+    Poly poly;
+    poly.reserve(vertices);
+    for (int i = 0; i < vertices; ++i)
+    {
+        const double angle = 2.0 * pi * i / vertices;
+        const long long r = radius + random.range(-jitter, jitter);
+        poly.push_back(IntPoint(cx + static_cast<long long>(r * std::cos(angle)), cy + static_cast<long long>(r * std::sin(angle))));
+    }
+    return poly;
+}
+
+static std::size_t countVertices(const Polys& polys)
+{
+    std::size_t count = 0;
+    for (const Poly& poly : polys)
+    {
+        count += poly.size();
+    }
+    return count;
+}
+
+static Polys execute(ClipType type, const Polys& subject, const Polys& clip)
+{
+    Clipper clipper;
+    addPolys(clipper, subject, ptSubject);
+    addPolys(clipper, clip, ptClip);
+    Polys solution;
+    clipper.Execute(type, solution, pftNonZero, pftNonZero);
+    return solution;
+}
+
+struct Workload
+{
+    std::string name;
+    std::size_t input_vertices;
+    std::function<std::size_t()> run; // Returns the number of output vertices, which also keeps the work observable
+};
+
+// Two overlapping outlines with a very high vertex count
+static Workload manyVertexUnion(int scale)
+{
+    Random random(1);
+    const int vertices = 100000 * scale;
+    Polys subject{ jitteredCircle(random, 0, 0, 50000000, vertices, 20000) };
+    Polys clip{ jitteredCircle(random, 10000000, 0, 50000000, vertices, 20000) };
+    return { "many_vertex_union", countVertices(subject) + countVertices(clip),
+             [subject, clip]() { return countVertices(execute(ctUnion, subject, clip)); } };
+}
+
+// A large plate with many holes punched into it
+static Workload difference(int scale)
+{
+    Random random(2);
+    Polys subject{ jitteredCircle(random, 0, 0, 100000000, 4096, 0) };
+    Polys clip;
+    for (int i = 0; i < 2000 * scale; ++i)
+    {
+        clip.push_back(jitteredCircle(random, random.range(-60000000, 60000000), random.range(-60000000, 60000000),
+                                      random.range(200000, 2000000), 64, 5000));
+    }
+    return { "difference", countVertices(subject) + countVertices(clip),
+             [subject, clip]() { return countVertices(execute(ctDifference, subject, clip)); } };
+}
+
+// Growing and shrinking a detailed outline, like the walls and skin of a layer
+static Workload offset(int scale)
+{
+    Random random(3);
+    Polys polys;
+    for (int i = 0; i < 50 * scale; ++i)
+    {
+        polys.push_back(jitteredCircle(random, random.range(-100000000, 100000000), random.range(-100000000, 100000000),
+                                       random.range(2000000, 10000000), 1000, 50000));
+    }
+    return { "offset", countVertices(polys),
+             [polys]() {
+                 Polys inset;
+                 Polys outset;
+                 offsetPolys(polys, inset, -400.0);
+                 offsetPolys(polys, outset, 400.0);
+                 return countVertices(inset) + countVertices(outset);
+             } };
+}
+
+// Layer-like slices: union the islands of each layer, subtract the holes and inset the result for the walls
+static Workload layerSlices(int scale)
+{
+    Random random(4);
+    std::vector<Polys> islands(100 * scale);
+    std::vector<Polys> holes(islands.size());
+    std::size_t input_vertices = 0;
+    for (std::size_t layer = 0; layer < islands.size(); ++layer)
+    {
+        for (int i = 0; i < 40; ++i)
+        {
+            islands[layer].push_back(jitteredCircle(random, random.range(-20000000, 20000000), random.range(-20000000, 20000000),
+                                                    random.range(1000000, 8000000), 128, 20000));
+        }
+        for (int i = 0; i < 20; ++i)
+        {
+            holes[layer].push_back(jitteredCircle(random, random.range(-20000000, 20000000), random.range(-20000000, 20000000),
+                                                  random.range(200000, 1000000), 32, 5000));
+        }
+        input_vertices += countVertices(islands[layer]) + countVertices(holes[layer]);
+    }
+    return { "layer_slices", input_vertices,
+             [islands, holes]() {
+                 std::size_t output_vertices = 0;
+                 for (std::size_t layer = 0; layer < islands.size(); ++layer)
+                 {
+                     const Polys outline = execute(ctDifference, execute(ctUnion, islands[layer], Polys()), holes[layer]);
+                     Polys walls;
+                     offsetPolys(outline, walls, -200.0);
+                     output_vertices += countVertices(walls);
+                 }
+                 return output_vertices;
+             } };
+}
+
+int main(int argc, char** argv)
+{
+    const int repetitions = argc > 1 ? std::max(1, std::atoi(argv[1])) : 5;
+    const int scale = argc > 2 ? std::max(1, std::atoi(argv[2])) : 1;
+
+    std::ostringstream json;
+    json << "{\n  \"clipper_major_version\": " << CLIPPER_MAJOR_VERSION << ",\n  \"repetitions\": " << repetitions
+         << ",\n  \"scale\": " << scale << ",\n  \"workloads\": [";
+
+    const std::vector<Workload> workloads{ manyVertexUnion(scale), difference(scale), offset(scale), layerSlices(scale) };
+    for (std::size_t i = 0; i < workloads.size(); ++i)
+    {
+        const Workload& workload = workloads[i];
+        std::vector<double> timings_ms;
+        std::size_t output_vertices = 0;
+        for (int repetition = 0; repetition < repetitions; ++repetition)
+        {
+            const auto start = std::chrono::steady_clock::now();
+            output_vertices = workload.run();
+            timings_ms.push_back(std::chrono::duration<double, std::milli>(std::chrono::steady_clock::now() - start).count());
+        }
+        std::sort(timings_ms.begin(), timings_ms.end());
+        const double median_ms = timings_ms[timings_ms.size() / 2];
+
+        json << (i == 0 ? "\n" : ",\n") << "    {\"name\": \"" << workload.name << "\", \"input_vertices\": " << workload.input_vertices
+             << ", \"output_vertices\": " << output_vertices << ", \"min_ms\": " << timings_ms.front() << ", \"median_ms\": " << median_ms
+             << ", \"vertices_per_second\": " << static_cast<long long>(workload.input_vertices / (median_ms / 1000.0)) << "}";
+        std::cerr << workload.name << ": " << median_ms << " ms\n";
+    }
+    json << "\n  ]\n}\n";
+
+    if (argc > 3)
+    {
+        std::ofstream(argv[3]) << json.str();
+    }
+    std::cout << json.str();
+    return 0;
+}
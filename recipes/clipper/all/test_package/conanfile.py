@@ -30,3 +30,10 @@ class TestPackageConan(ConanFile):
         if can_run(self):
             bin_path = os.path.join(self.cpp.build.bindirs[0], "test_package")
             self.run(bin_path, env="conanrun")
+
+            # Opt-in, the generated workloads take a while: -c user.clipper:benchmark=True
+            if self.conf.get("user.clipper:benchmark", default=False, check_type=bool):
+                benchmark_path = os.path.join(self.cpp.build.bindirs[0], "benchmark")
+                results = os.path.join(self.build_folder, "benchmark.json")
+                self.run(f"{benchmark_path} 5 1 {results}", env="conanrun")
+                self.output.info(f"Benchmark results written to {results}")
@@ -1,11 +1,14 @@
 from conan import ConanFile, conan_version
-from conan.tools.build import cross_building
+from conan.errors import ConanException
+from conan.tools.build import build_jobs, cross_building
 from conan.tools.env import Environment
-from conan.tools.files import chdir, copy, get, replace_in_file
+from conan.tools.files import check_sha256, chdir, copy, get, replace_in_file
 from conan.tools.layout import basic_layout
 from conan.tools.scm import Version
+import hashlib
 import json
 import os
+import shutil
 
 required_conan_version = ">=1.52.0"
 
@@ -18,6 +21,18 @@ class EmSDKConan(ConanFile):
     topics = ("emsdk", "emscripten", "sdk")
     license = "MIT"
     settings = "os", "arch", "compiler", "build_type"
+    options = {
+        "prebuilt_system_libs": [None, "ANY"],
+        "prebuilt_system_libs_lto": [True, False],
+        "package_file_mode": ["copy", "hardlink", "reflink"],
+        "compiler_cache": [None, "ccache", "sccache", "auto"],
+    }
+    default_options = {
+        "prebuilt_system_libs": None,
+        "prebuilt_system_libs_lto": False,
+        "package_file_mode": "copy",
+        "compiler_cache": None,
+    }
 
     short_paths = True
 
@@ -36,6 +51,8 @@ class EmSDKConan(ConanFile):
     def package_id(self):
         del self.info.settings.compiler
         del self.info.settings.build_type
+        del self.info.options.package_file_mode
+        del self.info.options.compiler_cache
 
     def source(self):
         get(self, **self.conan_data["sources"][self.version],
@@ -61,10 +78,29 @@ class EmSDKConan(ConanFile):
     def _em_config(self):
         return os.path.join(self.package_folder, "bin", ".emscripten")
 
+    @property
+    def _wasm_opt(self):
+        suffix = ".exe" if self._settings_build.os == "Windows" else ""
+        return os.path.join(self.package_folder, "bin", "upstream", "bin", f"wasm-opt{suffix}")
+
     @property
     def _em_cache(self):
         return os.path.join(self.package_folder, "bin", ".emscripten_cache")
 
+    @property
+    def _compiler_cache(self):
+        """ The ccache or sccache executable emcc wraps its clang invocations with, None when not requested or found """
+        compiler_cache = str(self.options.get_safe("compiler_cache"))
+        if compiler_cache == "None":
+            return None
+        candidates = ["sccache", "ccache"] if compiler_cache == "auto" else [compiler_cache]
+        for candidate in candidates:
+            executable = shutil.which(candidate)
+            if executable is not None:
+                return executable
+        self.output.warning(f"Compiler cache '{compiler_cache}' requested but not found, compiling without it")
+        return None
+
     def generate(self):
         env = Environment()
         env.prepend_path("PATH", self._paths)
@@ -72,6 +108,9 @@ class EmSDKConan(ConanFile):
         env.define_path("EMSCRIPTEN", self._emscripten)
         env.define_path("EM_CONFIG", self._em_config)
         env.define_path("EM_CACHE", self._em_cache)
+        compiler_cache = self._compiler_cache
+        if compiler_cache is not None:
+            env.define_path("EM_COMPILER_WRAPPER", compiler_cache)
         env.vars(self, scope="emsdk").save_script("emsdk_env_file")
 
     @staticmethod
@@ -96,6 +135,123 @@ class EmSDKConan(ConanFile):
             ret["nodejs"] = f"node-{node['version']}-64bit"
         return ret
 
+    @property
+    def _downloads(self):
+        return os.path.join(self.source_folder, "downloads")
+
+    @property
+    def _download_cache(self):
+        default_cache = os.path.join(os.path.expanduser("~"), ".emsdk", "downloads")
+        return self.conf.get("user.emsdk:download_cache", default=default_cache, check_type=str)
+
+    @staticmethod
+    def _link_or_copy(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    @staticmethod
+    def _reflink_or_copy(src, dst):
+        try:
+            import fcntl
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                fcntl.ioctl(d.fileno(), 0x40049409, s.fileno())  # FICLONE, copy-on-write clone on btrfs/xfs
+            shutil.copystat(src, dst)
+        except (ImportError, OSError):
+            shutil.copy2(src, dst)
+
+    @staticmethod
+    def _unshare(filename):
+        """Breaks the hardlink with the source folder before a file is modified in place"""
+        if os.stat(filename).st_nlink > 1:
+            shutil.copy2(filename, f"{filename}.tmp")
+            os.replace(f"{filename}.tmp", filename)
+
+    @staticmethod
+    def _sha256(filename):
+        sha256 = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _restore_tool_downloads(self, tool):
+        """
+        Puts the archives of the tool from the download cache in the emsdk downloads folder, where emsdk install picks
+        them up instead of downloading them again. The tool ids contain the release hash or the version, so they
+        identify the content of the archives.
+        """
+        cached_tool = os.path.join(self._download_cache, tool)
+        if not os.path.isdir(cached_tool):
+            return
+        os.makedirs(self._downloads, exist_ok=True)
+        for archive in os.listdir(cached_tool):
+            if archive.endswith(".sha256"):
+                continue
+            cached_archive = os.path.join(cached_tool, archive)
+            try:
+                with open(f"{cached_archive}.sha256", "r") as f:
+                    check_sha256(self, cached_archive, f.read().strip())
+            except (OSError, ConanException) as e:
+                self.output.warning(f"Removing the corrupt cached download {cached_archive}: {e}")
+                for corrupt_file in (cached_archive, f"{cached_archive}.sha256"):
+                    try:
+                        os.remove(corrupt_file)  # So the archive downloaded again is stored in its place
+                    except OSError:
+                        pass
+                continue
+            if not os.path.exists(os.path.join(self._downloads, archive)):
+                self.output.info(f"Using cached download {cached_archive}")
+                self._link_or_copy(cached_archive, os.path.join(self._downloads, archive))
+
+    def _store_tool_downloads(self, tool, previous_downloads):
+        cached_tool = os.path.join(self._download_cache, tool)
+        for archive in set(os.listdir(self._downloads)) - previous_downloads:
+            cached_archive = os.path.join(cached_tool, archive)
+            if os.path.exists(cached_archive):
+                continue
+            self.output.info(f"Storing download {archive} in the cache {cached_tool}")
+            os.makedirs(cached_tool, exist_ok=True)
+            # Write under a temporary name first, so concurrent builds never pick up a partial archive
+            self._link_or_copy(os.path.join(self._downloads, archive), f"{cached_archive}.tmp")
+            with open(f"{cached_archive}.sha256.tmp", "w") as f:
+                f.write(self._sha256(f"{cached_archive}.tmp"))
+            os.replace(f"{cached_archive}.sha256.tmp", f"{cached_archive}.sha256")
+            os.replace(f"{cached_archive}.tmp", cached_archive)
+
+    def _install_tool(self, emsdk, tool):
+        self._restore_tool_downloads(tool)
+        previous_downloads = set(os.listdir(self._downloads)) if os.path.isdir(self._downloads) else set()
+
+        env = Environment()
+        env.define("EMSDK_KEEP_DOWNLOADS", "1")  # Otherwise the archives are removed after extracting them
+        with env.vars(self).apply():
+            self.run(f"{emsdk} install {tool}")
+
+        if os.path.isdir(self._downloads):
+            self._store_tool_downloads(tool, previous_downloads)
+
+    def _prebuild_system_libs(self):
+        """
+        Builds the requested system libraries (comma separated embuilder targets, e.g. "MINIMAL" or "libc,libc-mt,libc++")
+        into the cache, which is shipped in the package, so consumers don't all build them on their first emcc call
+        """
+        libraries = " ".join(library.strip() for library in str(self.options.prebuilt_system_libs).split(","))
+        suffix = ".bat" if self._settings_build.os == "Windows" else ""
+        embuilder = os.path.join(self.source_folder, "upstream", "emscripten", f"embuilder{suffix}")
+        self._chmod_plus_x(embuilder)
+
+        env = Environment()
+        env.define_path("EM_CONFIG", os.path.join(self.source_folder, ".emscripten"))
+        env.define_path("EM_CACHE", os.path.join(self.source_folder, ".emscripten_cache"))
+        env.define("EMCC_CORES", str(build_jobs(self)))  # The sources of the system libraries are compiled in parallel
+        with env.vars(self).apply():
+            self.output.info(f"Building system libraries {libraries} into the cache")
+            self.run(f"{embuilder} build {libraries}")
+            if self.options.prebuilt_system_libs_lto:
+                self.run(f"{embuilder} build {libraries} --lto")
+
     def build(self):
         with chdir(self, self.source_folder):
             emsdk = "emsdk.bat" if self._settings_build.os == "Windows" else "./emsdk"
@@ -105,7 +261,7 @@ class EmSDKConan(ConanFile):
             required_tools = self._tools_for_version()
             for key, value in required_tools.items():
                 if key != 'nodejs':
-                    self.run(f"{emsdk} install {value}")
+                    self._install_tool(emsdk, value)
                     self.run(f"{emsdk} activate {value}")
 
         # Patch to fix the TypeScript generation of std::string (C++) -> string (TS)
@@ -118,11 +274,71 @@ class EmSDKConan(ConanFile):
                         "['std::basic_string<unsigned char>', [jsString, 'string']],",
                         "['std::basic_string<unsigned char>', ['string']],")
 
+        if self.options.prebuilt_system_libs:
+            self._prebuild_system_libs()
+
+    @property
+    def _pruned_folders(self):
+        """Folders of the emsdk source tree consumers don't need: the archives kept by emsdk install, the emscripten
+        test suite (except the CMake helpers exported through builddirs) and its website sources. docs/ is kept, emcc --help
+        reads docs/emcc.txt"""
+        emscripten = os.path.join("upstream", "emscripten")
+        return {
+            "downloads",
+            os.path.join(emscripten, "site"),
+        }
+
+    @property
+    def _test_folders(self):
+        emscripten = os.path.join("upstream", "emscripten")
+        return {os.path.join(emscripten, "test"), os.path.join(emscripten, "tests")}
+
+    _pruned_folder_names = {".git", ".github", ".circleci", "__pycache__"}
+
+    def _package_tree(self, src, dst):
+        mode = str(self.options.package_file_mode)
+        os.makedirs(dst, exist_ok=True)
+        if mode != "copy" and os.stat(src).st_dev != os.stat(dst).st_dev:
+            self.output.warning(f"Source and package folders are on different filesystems, ignoring package_file_mode={mode}")
+            mode = "copy"
+        copy_file = {"copy": shutil.copy2, "hardlink": self._link_or_copy, "reflink": self._reflink_or_copy}[mode]
+
+        pruned = 0
+        for root, dirs, files in os.walk(src):
+            relative_root = os.path.relpath(root, src)
+            if relative_root in self._test_folders:
+                pruned += len(files) + len(dirs) - ("cmake" in dirs)
+                files = []
+                dirs[:] = [d for d in dirs if d == "cmake"]
+            kept_dirs = []
+            for d in dirs:
+                relative_dir = os.path.normpath(os.path.join(relative_root, d))
+                if d in self._pruned_folder_names or relative_dir in self._pruned_folders:
+                    pruned += 1
+                elif os.path.islink(os.path.join(root, d)):
+                    os.symlink(os.readlink(os.path.join(root, d)), os.path.join(dst, relative_dir))
+                else:
+                    os.makedirs(os.path.join(dst, relative_dir), exist_ok=True)
+                    kept_dirs.append(d)
+            dirs[:] = kept_dirs
+
+            for f in files:
+                source_file = os.path.join(root, f)
+                package_file = os.path.join(dst, relative_root, f)
+                if os.path.lexists(package_file):
+                    os.remove(package_file)
+                if os.path.islink(source_file):
+                    os.symlink(os.readlink(source_file), package_file)
+                else:
+                    copy_file(source_file, package_file)
+        self.output.info(f"Packaged emsdk with {mode}, pruned {pruned} files and folders")
+
     def package(self):
         copy(self, "LICENSE", src=self.source_folder, dst=os.path.join(self.package_folder, "licenses"))
-        copy(self, "*", src=self.source_folder, dst=os.path.join(self.package_folder, "bin"))
+        self._package_tree(self.source_folder, self._emsdk)
         emscripten = os.path.join(self.package_folder, "bin", "upstream", "emscripten")
         toolchain = os.path.join(emscripten, "cmake", "Modules", "Platform", "Emscripten.cmake")
+        self._unshare(toolchain)
         # FIXME: conan should add the root of conan package requirements to CMAKE_PREFIX_PATH (LIBRARY/INCLUDE -> ONLY; PROGRAM -> NEVER)
         # allow to find conan libraries
         replace_in_file(self, toolchain,
@@ -135,12 +351,54 @@ class EmSDKConan(ConanFile):
                         "set(CMAKE_FIND_ROOT_PATH_MODE_PACKAGE ONLY)",
                         "set(CMAKE_FIND_ROOT_PATH_MODE_PACKAGE BOTH)")
 
+        # Emscripten clears the cache when the LLVM_ROOT recorded in its sanity file differs from the configured one, which
+        # happens for every consumer with another Conan home. A frozen cache is used as is and never written to, so the
+        # prebuilt system libraries are kept and the package folder can stay read-only. Libraries that weren't prebuilt
+        # can't be built on demand then, unless the consumer sets EM_FROZEN_CACHE=0 and EM_CACHE to a writable folder.
+        if self.options.prebuilt_system_libs:
+            self._unshare(self._em_config)
+            with open(self._em_config, "a") as em_config:
+                em_config.write("\nFROZEN_CACHE = True\n")
+
     def _define_tool_var(self, value):
         suffix = ".bat" if self.settings.os == "Windows" else ""
         path = os.path.join(self._emscripten, f"{value}{suffix}")
         self._chmod_plus_x(path)
         return path
 
+    # Flags injected into the consumer build for user.emsdk:opt_profile, LTO picks the LTO variants of the system libraries
+    _opt_profiles = {
+        "size": {
+            "cflags": ["-Oz", "-flto"],
+            "linkflags": ["-Oz", "-flto", "-sWASM_BIGINT", "--closure=1"],
+        },
+        "speed": {
+            "cflags": ["-O3", "-flto"],
+            "linkflags": ["-O3", "-flto", "-sWASM_BIGINT"],
+        },
+        "speed-simd": {
+            "cflags": ["-O3", "-flto", "-msimd128"],
+            "linkflags": ["-O3", "-flto", "-sWASM_BIGINT", "-msimd128"],
+        },
+    }
+
+    def _inject_opt_profile(self):
+        opt_profile = self.conf.get("user.emsdk:opt_profile", check_type=str)
+        if opt_profile is not None:
+            if opt_profile not in self._opt_profiles:
+                raise ConanException(f"Unknown user.emsdk:opt_profile={opt_profile}, use one of {', '.join(self._opt_profiles)}")
+            flags = self._opt_profiles[opt_profile]
+            self.conf_info.append("tools.build:cflags", flags["cflags"])
+            self.conf_info.append("tools.build:cxxflags", flags["cflags"])
+            self.conf_info.append("tools.build:sharedlinkflags", flags["linkflags"])
+            self.conf_info.append("tools.build:exelinkflags", flags["linkflags"])
+
+        # Extra wasm-opt passes run by emcc after linking, e.g. "-O4,--converge"
+        wasm_opt_passes = self.conf.get("user.emsdk:wasm_opt_passes", check_type=str)
+        if wasm_opt_passes:
+            self.conf_info.append("tools.build:sharedlinkflags", [f"-sBINARYEN_EXTRA_PASSES={wasm_opt_passes}"])
+            self.conf_info.append("tools.build:exelinkflags", [f"-sBINARYEN_EXTRA_PASSES={wasm_opt_passes}"])
+
     def package_info(self):
         self.cpp_info.bindirs = self._relative_paths
         self.cpp_info.includedirs = []
@@ -165,6 +423,10 @@ class EmSDKConan(ConanFile):
         self.buildenv_info.define_path("EMSCRIPTEN", self._emscripten)
         self.buildenv_info.define_path("EM_CONFIG", self._em_config)
         self.buildenv_info.define_path("EM_CACHE", self._em_cache)
+        # emcc prefixes its clang invocations with the wrapper, so CC/CXX and the user toolchain keep pointing at emcc
+        compiler_cache = self._compiler_cache
+        if compiler_cache is not None:
+            self.buildenv_info.define_path("EM_COMPILER_WRAPPER", compiler_cache)
 
         compiler_executables = {
             "c": self._define_tool_var("emcc"),
@@ -177,6 +439,8 @@ class EmSDKConan(ConanFile):
         self.buildenv_info.define_path("NM", self._define_tool_var("emnm"))
         self.buildenv_info.define_path("RANLIB", self._define_tool_var("emranlib"))
         self.buildenv_info.define_path("STRIP", self._define_tool_var("emstrip"))
+        self.buildenv_info.define_path("WASM_OPT", self._wasm_opt)
+        self._inject_opt_profile()
 
         self.cpp_info.builddirs = [
             os.path.join("bin", "releases", "src"),
@@ -195,6 +459,8 @@ class EmSDKConan(ConanFile):
             self.env_info.EMSCRIPTEN = self._emscripten
             self.env_info.EM_CONFIG = self._em_config
             self.env_info.EM_CACHE = self._em_cache
+            if compiler_cache is not None:
+                self.env_info.EM_COMPILER_WRAPPER = compiler_cache
             self.env_info.CC = compiler_executables["c"]
             self.env_info.CXX = compiler_executables["cpp"]
             self.env_info.AR = self._define_tool_var("emar")
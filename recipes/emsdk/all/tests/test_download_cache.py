@@ -0,0 +1,116 @@
+import importlib.util
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location("emsdk_conanfile", Path(__file__).parents[1] / "conanfile.py")
+emsdk = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(emsdk)
+
+from conan.errors import ConanException
+from conans.model.conf import Conf
+from conans.model.settings import Settings
+
+TOOL = "releases-3a8a3f0e9bc2ec83ae7f8fa3f6d5ab4f2ca4a5c8-64bit"
+
+# Stands in for emsdk install: like emsdk it only downloads the archives that aren't in its downloads folder yet, and
+# removes them after extracting unless EMSDK_KEEP_DOWNLOADS is set
+EMSDK = textwrap.dedent(f"""\
+    #!{sys.executable}
+    import os, sys, urllib.request
+    archive = os.path.join("downloads", f"{{sys.argv[2]}}.tar.xz")
+    os.makedirs("downloads", exist_ok=True)
+    if not os.path.exists(archive):
+        urllib.request.urlretrieve(f"{{os.environ['EMSDK_TEST_MIRROR']}}/{{sys.argv[2]}}.tar.xz", archive)
+    if os.environ.get("EMSDK_KEEP_DOWNLOADS") != "1":
+        os.remove(archive)
+""")
+
+
+class EmSDK(emsdk.EmSDKConan):
+    ''' The emsdk recipe building in source_folder, with its tool downloads cached in download_cache '''
+
+    def __init__(self, source_folder, download_cache):
+        super().__init__("emsdk")
+        self.folders.set_base_source(str(source_folder))
+        self.settings_build = Settings({"os": ["Linux", "Windows", "Macos"]})
+        self.settings_build.os = "Linux"
+        self.conf = Conf()
+        self.conf.define("user.emsdk:download_cache", str(download_cache))
+
+    def run(self, command, **kwargs):
+        if subprocess.run(command, shell = True, cwd = self.source_folder).returncode != 0:
+            raise ConanException(f"Error while executing {command}")
+
+    def install(self):
+        emsdk_script = Path(self.source_folder, "emsdk")
+        emsdk_script.write_text(EMSDK)
+        emsdk_script.chmod(0o755)
+        self._install_tool("./emsdk", TOOL)
+
+
+class ToolMirror(SimpleHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    ''' A local file server with the archive of the tool, standing in for the emscripten release storage '''
+    served = tmp_path / "mirror"
+    served.mkdir()
+    (served / f"{TOOL}.tar.xz").write_bytes(os.urandom(64 * 1024))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(ToolMirror, directory = str(served)))
+    server.requests = []
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    monkeypatch.setenv("EMSDK_TEST_MIRROR", f"http://127.0.0.1:{server.server_port}")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _source_folder(tmp_path, profile):
+    source_folder = tmp_path / profile / "src"
+    source_folder.mkdir(parents = True)
+    return source_folder
+
+
+def test_second_install_is_offline(tmp_path, mirror):
+    cache = tmp_path / "cache"
+    EmSDK(_source_folder(tmp_path, "release"), cache).install()
+    assert mirror.requests == [f"/{TOOL}.tar.xz"]
+    assert (cache / TOOL / f"{TOOL}.tar.xz").is_file()
+    assert (cache / TOOL / f"{TOOL}.tar.xz.sha256").is_file()
+
+    # Building emsdk for another profile, without the network
+    mirror.shutdown()
+    source_folder = _source_folder(tmp_path, "debug")
+    EmSDK(source_folder, cache).install()
+    assert mirror.requests == [f"/{TOOL}.tar.xz"]
+    assert (source_folder / "downloads" / f"{TOOL}.tar.xz").read_bytes() == (cache / TOOL / f"{TOOL}.tar.xz").read_bytes()
+
+
+def test_corrupt_download_is_replaced(tmp_path, mirror):
+    cache = tmp_path / "cache"
+    EmSDK(_source_folder(tmp_path, "release"), cache).install()
+    cached_archive = cache / TOOL / f"{TOOL}.tar.xz"
+    cached_archive.write_bytes(b"truncated")
+
+    EmSDK(_source_folder(tmp_path, "debug"), cache).install()
+    assert mirror.requests == [f"/{TOOL}.tar.xz"] * 2
+    assert cached_archive.read_bytes() != b"truncated"
+
+    mirror.requests.clear()
+    EmSDK(_source_folder(tmp_path, "minsizerel"), cache).install()
+    assert mirror.requests == []
@@ -1,8 +1,9 @@
 import os
+import shutil
 
 from conan import ConanFile
-from conan.errors import ConanInvalidConfiguration
-from conan.tools.files import copy, get
+from conan.errors import ConanException, ConanInvalidConfiguration
+from conan.tools.files import check_sha256, copy, download, get, unzip
 
 
 required_conan_version = ">=1.59.0"
@@ -45,16 +46,76 @@ class NodejsConan(ConanFile):
         if not self._dl_info:
             raise ConanInvalidConfiguration("Binaries for this combination of architecture/version/os not available")
 
+    @property
+    def _download_cache(self):
+        default_cache = os.path.join(os.path.expanduser("~"), ".nodejs", "downloads")
+        return self.conf.get("user.nodejs:download_cache", default=default_cache, check_type=str)
+
+    def _cached_archive(self):
+        """ The archive from the local cache, keyed by its sha256, downloading it into the cache when it isn't there yet """
+        url, sha256 = self._dl_info["url"], self._dl_info["sha256"]
+        archive = os.path.join(self._download_cache, sha256, url.split("/")[-1])
+        if os.path.exists(archive):
+            try:
+                check_sha256(self, archive, sha256)
+                self.output.info(f"Using cached {archive}")
+                return archive
+            except ConanException:
+                self.output.warning(f"Ignoring corrupt cached {archive}")
+                os.remove(archive)
+
+        try:
+            os.makedirs(os.path.dirname(archive), exist_ok=True)
+            download(self, url, f"{archive}.tmp", sha256=sha256)
+            os.replace(f"{archive}.tmp", archive)
+        except OSError as e:
+            self.output.warning(f"Could not store {url} in the download cache: {e}")
+            return None
+        finally:
+            if os.path.exists(f"{archive}.tmp"):
+                os.remove(f"{archive}.tmp")
+        return archive
+
     def build(self):
-        get(self, **self._dl_info, strip_root=True)
+        archive = self._cached_archive()
+        if archive is None:
+            get(self, **self._dl_info, strip_root=True)
+        else:
+            unzip(self, archive, strip_root=True)
+
+    @staticmethod
+    def _link_or_copy(src, dst):
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            return
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    def _link_tree(self, src, dst):
+        """ Hardlinks the extracted files into the package, the build folder is a throwaway extraction of the archive """
+        for root, dirs, files in os.walk(src):
+            relative_root = os.path.relpath(root, src)
+            os.makedirs(os.path.join(dst, relative_root), exist_ok=True)
+            for d in [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+                dirs.remove(d)
+                files.append(d)
+            for f in files:
+                package_file = os.path.join(dst, relative_root, f)
+                if os.path.lexists(package_file):
+                    os.remove(package_file)
+                self._link_or_copy(os.path.join(root, f), package_file)
 
     def package(self):
         copy(self, "LICENSE", dst=os.path.join(self.package_folder, "licenses"), src=self.build_folder)
-        copy(self, "*", dst=os.path.join(self.package_folder, "bin"), src=os.path.join(self.build_folder, "bin"))
-        copy(self, "*", dst=os.path.join(self.package_folder, "lib"), src=os.path.join(self.build_folder, "lib"))
-        copy(self, "node.exe", dst=os.path.join(self.package_folder, "bin"), src=self.build_folder)
-        copy(self, "npm", dst=os.path.join(self.package_folder, "bin"), src=self.build_folder)
-        copy(self, "npx", dst=os.path.join(self.package_folder, "bin"), src=self.build_folder)
+        for folder in ("bin", "lib"):
+            if os.path.isdir(os.path.join(self.build_folder, folder)):
+                self._link_tree(os.path.join(self.build_folder, folder), os.path.join(self.package_folder, folder))
+        for executable in ("node.exe", "npm", "npx"):
+            if os.path.lexists(os.path.join(self.build_folder, executable)):
+                os.makedirs(os.path.join(self.package_folder, "bin"), exist_ok=True)
+                self._link_or_copy(os.path.join(self.build_folder, executable), os.path.join(self.package_folder, "bin", executable))
 
     def package_info(self):
         self.cpp_info.includedirs = []
@@ -1,7 +1,20 @@
+import gzip
+import hashlib
+import json
+import io
 import os
+import shutil
+import tarfile
 from pathlib import Path
 
 from conan import ConanFile
+from conan.tools.env import VirtualBuildEnv
+from conan.tools.files import save
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 required_conan_version = ">=2.7.0"
 
@@ -40,6 +53,180 @@ def conf_package_json(conanfile: ConanFile, **kwargs):
     conanfile.conf_info.define(f"user.{conanfile.name.lower()}:package_json", package_json)
 
 
+# The emcc flags enabling wasm features, mapped to the wasm-opt flags enabling the same features. Threads use shared
+# memory, which emscripten initializes with the passive segments of bulk memory
+_wasm_feature_flags = {
+    "-msimd128": ["--enable-simd"],
+    "-mrelaxed-simd": ["--enable-simd", "--enable-relaxed-simd"],
+    "-pthread": ["--enable-threads", "--enable-bulk-memory"],
+    "-sUSE_PTHREADS": ["--enable-threads", "--enable-bulk-memory"],
+    "-sSHARED_MEMORY": ["--enable-threads", "--enable-bulk-memory"],
+    "-matomics": ["--enable-threads"],
+    "-mbulk-memory": ["--enable-bulk-memory"],
+    "-msign-ext": ["--enable-sign-ext"],
+    "-mnontrapping-fptoint": ["--enable-nontrapping-float-to-int"],
+    "-mmutable-globals": ["--enable-mutable-globals"],
+    "-mmultivalue": ["--enable-multivalue"],
+    "-mreference-types": ["--enable-reference-types"],
+    "-mtail-call": ["--enable-tail-call"],
+    "-fwasm-exceptions": ["--enable-exception-handling"],
+    "-sMEMORY64": ["--enable-memory64"],
+}
+
+
+def _wasm_feature_args(flags):
+    features = {}
+    tokens = " ".join(flags).split()
+    for index, token in enumerate(tokens):
+        if token == "-s" and index + 1 < len(tokens):  # The "-s USE_PTHREADS" spelling
+            token = f"-s{tokens[index + 1]}"
+        if token.startswith("-s") and token.endswith("=1"):
+            token = token[:-2]
+        if token.startswith("-mno-"):
+            for feature in _wasm_feature_flags.get(f"-m{token[5:]}", []):
+                features.pop(feature, None)
+        else:
+            features.update(dict.fromkeys(_wasm_feature_flags.get(token, [])))
+    return list(features)
+
+
+def default_wasm_opt_args(conanfile: ConanFile):
+    """
+    The default wasm-opt arguments. emcc strips the target_features section wasm-opt would detect the features from, so
+    the features are derived from the compile and link flags of the build (which include those of the emsdk
+    optimisation profiles), e.g. -msimd128 enables SIMD and -pthread threads
+    """
+    flags = []
+    for conf in ("tools.build:cflags", "tools.build:cxxflags", "tools.build:exelinkflags", "tools.build:sharedlinkflags"):
+        flags += conanfile.conf.get(conf, default=[], check_type=list)
+    return ["-O3"] + _wasm_feature_args(flags)
+
+
+def _sha256(path: Path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _compress(path: Path, encodings):
+    compressed = {}
+    data = path.read_bytes()
+    if "gz" in encodings:
+        compressed["gz"] = path.with_name(f"{path.name}.gz")
+        with open(compressed["gz"], "wb") as f:
+            # mtime 0 and no file name in the header keep the output reproducible
+            with gzip.GzipFile(filename="", mode="wb", compresslevel=9, fileobj=f, mtime=0) as gz:
+                gz.write(data)
+    if "br" in encodings and brotli is not None:
+        compressed["br"] = path.with_name(f"{path.name}.br")
+        compressed["br"].write_bytes(brotli.compress(data, quality=11))
+    return compressed
+
+
+def optimize_wasm_artifacts(conanfile: ConanFile, entry_point, wasm_opt_args=None, compress=("br", "gz"),
+                            content_hash=False):
+    """
+    Post-link stage for the emscripten output of a bindings package, run from package(). Optimizes the .wasm files next
+    to the entry point (relative to the package folder) with wasm-opt, optionally renames them to content-hashed names
+    for cache busting, emits precompressed copies and writes their sizes and hashes to artifacts.json. The wasm-opt from
+    the emsdk build environment (WASM_OPT) is used, when it isn't available that step is skipped. Without wasm_opt_args
+    the features enabled by the compile and link flags of the build are passed to wasm-opt (default_wasm_opt_args).
+    """
+    entry_point = Path(conanfile.package_folder, entry_point)
+    # The build environment of the tool requires is only applied to the commands run by the conanfile
+    wasm_opt = VirtualBuildEnv(conanfile).vars().get("WASM_OPT") or shutil.which("wasm-opt")
+    if wasm_opt is None:
+        conanfile.output.warning("wasm-opt not found, packaging the wasm files unoptimized")
+    if "br" in compress and brotli is None:
+        conanfile.output.warning("brotli module not found, skipping the brotli precompressed copies")
+
+    artifacts = {}
+    for wasm in sorted(entry_point.parent.glob("*.wasm")):
+        if wasm_opt is not None:
+            args = " ".join(wasm_opt_args or default_wasm_opt_args(conanfile))
+            conanfile.run(f'"{wasm_opt}" {args} "{wasm}" -o "{wasm}"')
+
+        sha256 = _sha256(wasm)
+        if content_hash:
+            hashed = wasm.with_name(f"{wasm.stem}.{sha256[:8]}.wasm")
+            wasm.replace(hashed)
+            # The emscripten glue locates the wasm file by its name
+            glue = entry_point.read_text(encoding="utf-8")
+            save(conanfile, entry_point, glue.replace(f'"{wasm.name}"', f'"{hashed.name}"').replace(f"'{wasm.name}'", f"'{hashed.name}'"))
+            wasm = hashed
+        artifacts[wasm.name] = {"size": wasm.stat().st_size, "sha256": sha256}
+
+    for path in [entry_point] + [entry_point.parent / name for name in list(artifacts)]:
+        artifact = artifacts.setdefault(path.name, {"size": path.stat().st_size, "sha256": _sha256(path)})
+        for encoding, compressed in _compress(path, compress).items():
+            artifact[encoding] = {"size": compressed.stat().st_size, "sha256": _sha256(compressed)}
+        sizes = [f"{artifact['size']} bytes"] + [f"{e} {artifact[e]['size']} bytes" for e in compress if e in artifact]
+        conanfile.output.info(f"{path.name}: {', '.join(sizes)}")
+
+    save(conanfile, entry_point.parent / "artifacts.json", json.dumps(artifacts, indent=2, sort_keys=True))
+    return artifacts
+
+
+# Timestamp npm itself uses for the entries of reproducible tarballs (1985-10-26T08:15:00Z)
+NPM_TARBALL_MTIME = 499162500
+
+
+def _npm_package_files(root: Path, package_json):
+    files = set()
+    for entry in package_json.get("files", []):
+        path = root / entry
+        if path.is_dir():
+            files.update(p for p in path.rglob("*") if p.is_file())
+        elif path.is_file():
+            files.add(path)
+    files.discard(root / "package.json")  # Always written from the package_json dict
+    return sorted(files, key=lambda p: p.relative_to(root).as_posix())
+
+
+def _tar_info(name, size, executable):
+    info = tarfile.TarInfo(f"package/{name}")
+    info.size = size
+    info.mtime = NPM_TARBALL_MTIME
+    info.mode = 0o755 if executable else 0o644
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    return info
+
+
+def pack_npm_package(conanfile: ConanFile, package_json, destination=None):
+    """
+    Creates the npm tarball for a package_json from generate_package_json() out of the files it lists, relative to the
+    package folder, without running npm pack. Entries are sorted and have fixed ownership and mtimes, so the same inputs
+    give a byte identical tarball, and an existing tarball is reused when the hash of its inputs is unchanged.
+    Returns the path to the tarball.
+    """
+    root = Path(conanfile.package_folder)
+    destination = Path(destination or root)
+    tarball = destination / f"{package_json['name'].lstrip('@').replace('/', '-')}-{package_json['version']}.tgz"
+    stamp = tarball.with_name(f"{tarball.name}.sha256")
+
+    manifest = json.dumps(package_json, indent=2).encode("utf-8")
+    files = [path for path in _npm_package_files(root, package_json) if path not in (tarball, stamp)]
+    inputs = hashlib.sha256(manifest)
+    for path in files:
+        inputs.update(f"{path.relative_to(root).as_posix()}:{os.access(path, os.X_OK)}:{_sha256(path)}\n".encode("utf-8"))
+    inputs = inputs.hexdigest()
+
+    if tarball.exists() and stamp.exists() and stamp.read_text().strip() == inputs:
+        conanfile.output.info(f"Reusing {tarball.name}, its inputs are unchanged")
+        return tarball
+
+    destination.mkdir(parents=True, exist_ok=True)
+    with open(tarball, "wb") as f:
+        with gzip.GzipFile(filename="", mode="wb", compresslevel=9, fileobj=f, mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode="w", format=tarfile.USTAR_FORMAT) as tar:
+                tar.addfile(_tar_info("package.json", len(manifest), False), io.BytesIO(manifest))
+                for path in files:
+                    with open(path, "rb") as content:
+                        tar.addfile(_tar_info(path.relative_to(root).as_posix(), path.stat().st_size, os.access(path, os.X_OK)), content)
+    stamp.write_text(inputs)
+    conanfile.output.info(f"Packed {len(files) + 1} files into {tarball}")
+    return tarball
+
+
 class PyReq(ConanFile):
     name = "npmpackage"
     description = "This is a base conan file description for C++ libraries/applications that use the npm generator"
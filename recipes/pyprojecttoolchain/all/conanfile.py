@@ -1,20 +1,95 @@
+import os
 import textwrap
+from functools import lru_cache
 from pathlib import Path
+from shutil import which
 
 from jinja2 import Template
 
 from conan import ConanFile
+from conan.tools.build import build_jobs
+from conan.tools.env import VirtualBuildEnv
 from conan.tools.microsoft import VCVars
 from conan.tools.cmake.toolchain.blocks import Block
 from conan.tools.cmake.toolchain.toolchain import ToolchainBlocks
 from conan.tools.gnu.autotoolstoolchain import AutotoolsToolchain
-from conan.tools.files import save
+from conan.tools.files import load, save
 from conan.errors import ConanInvalidConfiguration
 from conan.tools.scm import Version
 from conan.tools import CppInfo
 
 
-class BuildSystemBlock(Block):
+@lru_cache(maxsize = None)
+def compile_template(template: str) -> Template:
+    """ Compiles a Jinja template only once, the blocks are rendered with the same templates over and over again """
+    return Template(template, trim_blocks = True, lstrip_blocks = True)
+
+
+class PyProjectBlock(Block):
+    def get_rendered_content(self):
+        context = self.values
+        if context is None:
+            return
+        return compile_template(self.template).render(**context)
+
+
+def option_or_build_jobs(conanfile: ConanFile, option: str) -> int:
+    """ Returns the integer value of the option, defaulting to the number of build jobs (the core count by default) """
+    value = conanfile.options.get_safe(option)
+    if value is None:
+        return build_jobs(conanfile)
+    return int(str(value))
+
+
+def find_compiler_cache(conanfile: ConanFile, warn: bool = True):
+    """
+    The compiler cache executable requested with the 'py_compiler_cache' option, which is either 'ccache', 'sccache'
+    or 'auto' to use the first one found. None when it isn't requested or can't be used.
+    """
+    compiler_cache = conanfile.options.get_safe("py_compiler_cache")
+    if compiler_cache is None or str(compiler_cache) == "None":
+        return None
+    if conanfile.settings.get_safe("compiler") == "msvc":
+        if warn:
+            conanfile.output.warning("The compiler cache isn't supported with msvc, compiling without it")
+        return None
+
+    candidates = ["sccache", "ccache"] if str(compiler_cache) == "auto" else [str(compiler_cache)]
+    for candidate in candidates:
+        executable = which(candidate)
+        if executable is not None:
+            return Path(executable).as_posix()
+    if warn:
+        conanfile.output.warning(f"Compiler cache '{compiler_cache}' requested but not found, compiling without it")
+    return None
+
+
+def compiler_cache_stats_log(conanfile: ConanFile) -> Path:
+    """ The ccache statistics log of this build, only the compilations of this build folder are recorded in it """
+    return Path(conanfile.build_folder, "ccache-stats.log")
+
+
+def show_compiler_cache_stats(conanfile: ConanFile) -> None:
+    """
+    Prints the hit rates of the compiler cache, to be called by the consumer after its build. For ccache these are the
+    statistics of this build only, taken from its statistics log, sccache reports those of its server.
+    """
+    compiler_cache = find_compiler_cache(conanfile, warn = False)
+    if compiler_cache is None:
+        return
+    conanfile.output.info("Compiler cache statistics:")
+    if Path(compiler_cache).stem == "ccache":
+        stats_log = compiler_cache_stats_log(conanfile)
+        if not stats_log.exists():
+            conanfile.output.info("No compilations went through the compiler cache")
+            return
+        # --show-log-stats reads the stats_log configured in the conanpyprojecttoolchain environment (ccache >= 4.4)
+        if conanfile.run(f'"{compiler_cache}" --show-log-stats', ignore_errors = True) == 0:
+            return
+    conanfile.run(f'"{compiler_cache}" --show-stats')
+
+
+class BuildSystemBlock(PyProjectBlock):
     template = textwrap.dedent("""
     [build-system]
     requires = [{{ build_requires }}]
@@ -31,7 +106,7 @@ class BuildSystemBlock(Block):
         return {"build_requires": build_requires, "build_backend": build_backend}
 
 
-class ToolSipMetadataBlock(Block):
+class ToolSipMetadataBlock(PyProjectBlock):
     template = textwrap.dedent("""
     [tool.sip.metadata]
     name = "{{ name }}"
@@ -74,13 +149,14 @@ class ToolSipMetadataBlock(Block):
         }
 
 
-class ToolSipProjectPyQtBuilder(Block):
+class ToolSipProjectPyQtBuilder(PyProjectBlock):
     template = textwrap.dedent("""
     {% if link_full_dll %}link-full-dll = true
     {% endif %}py-pylib-dir = "{{ py_pylib_dir }}"
     py-pylib-lib = "{{ py_pylib_lib }}"
     {% if py_pylib_shlib is not none %}py-pylib-shlib = "{{ py_pylib_shlib }}"
     {% endif %}qml-debug = {{ qml_debug | lower }}
+    jobs = {{ jobs }}
     """)
 
     def context(self):
@@ -103,11 +179,12 @@ class ToolSipProjectPyQtBuilder(Block):
             "py_pylib_dir": py_lib_dir,
             "py_pylib_lib": py_lib,
             "py_pylib_shlib": py_lib,
-            "qml_debug": self._conanfile.settings.get_safe("build_type", "Release") == "Debug"
+            "qml_debug": self._conanfile.settings.get_safe("build_type", "Release") == "Debug",
+            "jobs": option_or_build_jobs(self._conanfile, "py_build_jobs")
         }
 
 
-class ToolSipProjectBlock(Block):
+class ToolSipProjectBlock(PyProjectBlock):
     template = textwrap.dedent("""
     [tool.sip.project]
     compile = {{ compile | lower }}
@@ -169,7 +246,7 @@ class ToolSipProjectBlock(Block):
         }
 
 
-class ToolSipBindingsExtraSourcesBlock(Block):
+class ToolSipBindingsExtraSourcesBlock(PyProjectBlock):
     template = textwrap.dedent("""
     headers = {{ headers }}
     sources = {{ sources }}
@@ -182,7 +259,7 @@ class ToolSipBindingsExtraSourcesBlock(Block):
         }
 
 
-class ToolSipBindingBlockCompile(Block):
+class ToolSipBindingBlockCompile(PyProjectBlock):
     template = textwrap.dedent("""
     extra-compile-args = {{ compileargs }}
     extra-link-args = {{ linkargs }}
@@ -195,7 +272,7 @@ class ToolSipBindingBlockCompile(Block):
         }
 
 
-class ToolSipBindingsBlock(Block):
+class ToolSipBindingsBlock(PyProjectBlock):
     template = textwrap.dedent("""
     [tool.sip.bindings.{{ name }}]
     exceptions = true
@@ -204,18 +281,14 @@ class ToolSipBindingsBlock(Block):
     library-dirs = {{ libdirs }}
     include-dirs = {{ includedirs }}
     pep484-pyi = true
+    concatenate = {{ concatenate }}
     static = {{ build_static | lower }}
     debug = {{ build_debug | lower }}
     """)
 
     def context(self):
         settings = self._conanfile.settings
-        aggregated_cpp_info = CppInfo(self._conanfile)
-        deps = self._conanfile.dependencies.host.topological_sort
-        deps = [dep for dep in reversed(deps.values())]
-        for dep in deps:
-            dep_cppinfo = dep.cpp_info.aggregated_components()
-            aggregated_cpp_info.merge(dep_cppinfo)
+        aggregated_cpp_info = self._toolchain.aggregated_cpp_info
 
         build_type = settings.get_safe("build_type", "Release")
         shared = settings.get_safe("shared", True)
@@ -231,6 +304,7 @@ class ToolSipBindingsBlock(Block):
             "libs": libs,
             "libdirs": libdirs,
             "includedirs": includedirs,
+            "concatenate": option_or_build_jobs(self._conanfile, "py_sip_concatenate"),
             "build_static": str(not shared),
             "build_debug": str(build_type == "Debug")
         }
@@ -239,16 +313,17 @@ class ToolSipBindingsBlock(Block):
 class PyProjectToolchain(AutotoolsToolchain):
     _pyproject_filename = Path("pyproject.toml")
 
-    _pyproject_template = textwrap.dedent("""
+    _pyproject_template = compile_template(textwrap.dedent("""
     # Conan automatically generated pyproject.toml file
     # DO NOT EDIT MANUALLY, it will be overwritten
 
     {% for conan_block in conan_blocks %}{{ conan_block }}
     {% endfor %}
-    """)
+    """))
 
     def __init__(self, conanfile: ConanFile, namespace = None):
         super().__init__(conanfile, namespace)
+        self._aggregated_cpp_info = None
 
         blocks = [
             ("build_system", BuildSystemBlock),
@@ -265,25 +340,70 @@ class PyProjectToolchain(AutotoolsToolchain):
 
         self.blocks = ToolchainBlocks(self._conanfile, self, blocks)
 
+    @property
+    def aggregated_cpp_info(self):
+        """ The cpp_info of all the host dependencies merged together, only computed once per toolchain """
+        if self._aggregated_cpp_info is None:
+            self._aggregated_cpp_info = CppInfo(self._conanfile)
+            deps = self._conanfile.dependencies.host.topological_sort
+            for dep in reversed(deps.values()):
+                self._aggregated_cpp_info.merge(dep.cpp_info.aggregated_components())
+        return self._aggregated_cpp_info
+
+    @property
+    def compiler_cache(self):
+        """ The compiler cache executable, see find_compiler_cache() """
+        return find_compiler_cache(self._conanfile)
+
+    def _configured_compilers(self):
+        """
+        The C and C++ compilers of this build: from tools.build:compiler_executables, else the CC/CXX of the profile
+        [buildenv] or the environment, else the cc/c++ the build systems default to
+        """
+        compilers = self._conanfile.conf.get("tools.build:compiler_executables", default = {}, check_type = dict)
+        buildenv = VirtualBuildEnv(self._conanfile, auto_generate = True).vars()
+        return (compilers.get("c") or buildenv.get("CC") or os.environ.get("CC") or "cc",
+                compilers.get("cpp") or buildenv.get("CXX") or os.environ.get("CXX") or "c++")
+
+    def _wrap_compilers(self, env, compiler_cache):
+        """ Routes the configured compilers via the compiler cache """
+        for name, compiler in zip(("CC", "CXX"), self._configured_compilers()):
+            if Path(compiler.split()[0]).stem not in ("ccache", "sccache"):
+                compiler = f"{compiler_cache} {compiler}"
+            env.define(name, compiler)
+        env.define_path("CCACHE_STATSLOG", str(compiler_cache_stats_log(self._conanfile)))
+
+        # Rewrite absolute paths relative to the common root of the source and build folders, so cache hits survive
+        # different build folders
+        base_dir = os.path.commonpath([self._conanfile.source_folder, self._conanfile.build_folder])
+        env.define_path("CCACHE_BASEDIR", base_dir)
+        env.define("CCACHE_NOHASHDIR", "true")
+        self._conanfile.output.info(f"Compiling through the compiler cache {compiler_cache}")
+
     @property
     def _context(self):
-        blocks = self.blocks.process_blocks()
-        print(blocks)
-        return {"conan_blocks": blocks}
+        return {"conan_blocks": self.blocks.process_blocks()}
 
     @property
     def content(self):
-        content = Template(self._pyproject_template, trim_blocks = True, lstrip_blocks = True).render(**self._context)
-        return content
+        return self._pyproject_template.render(**self._context)
 
     def generate(self, env = None, scope = "build"):
         env = env or self.environment()
+        compiler_cache = self.compiler_cache
+        if compiler_cache is not None:
+            self._wrap_compilers(env, compiler_cache)
         env = env.vars(self._conanfile, scope = scope)
         env.save_script("conanpyprojecttoolchain")
         VCVars(self._conanfile).generate(scope = scope)
 
         py_project_filename = Path(self._conanfile.source_folder, self._pyproject_filename)
-        save(self._conanfile, py_project_filename, self.content)
+        content = self.content
+        # Keep the existing file (and its mtime) when nothing changed, otherwise sip-build regenerates all the bindings
+        if py_project_filename.exists() and load(self._conanfile, py_project_filename) == content:
+            self._conanfile.output.info(f"{py_project_filename} is up to date, skipped writing it")
+        else:
+            save(self._conanfile, py_project_filename, content)
 
 
 class PyProjectToolchainPkg(ConanFile):
@@ -1,12 +1,160 @@
 from conan import ConanFile
 
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from io import StringIO
 from pathlib import Path
 from shutil import which
+from typing import Optional
 
 from conan.errors import ConanInvalidConfiguration, ConanException
 
 required_conan_version = ">=2.7.0"
 
+SHT_NOTE = 7
+SHF_COMPRESSED = 0x800
+ELFCOMPRESS_ZLIB = 1
+NT_GNU_BUILD_ID = 3
+LC_UUID = 0x1b
+
+
+def _align4(size):
+    return (size + 3) & ~3
+
+
+def _elf_sections(data):
+    ''' Yields the name, type, flags and contents of the sections of an ELF binary '''
+    endian = "<" if data[5] == 1 else ">"
+    if data[4] == 2:  # 64 bits
+        section_offset, = struct.unpack_from(f"{endian}Q", data, 0x28)
+        section_size, section_count, names_index = struct.unpack_from(f"{endian}HHH", data, 0x3a)
+        section_format = f"{endian}IIQQQQ"
+    else:
+        section_offset, = struct.unpack_from(f"{endian}I", data, 0x20)
+        section_size, section_count, names_index = struct.unpack_from(f"{endian}HHH", data, 0x2e)
+        section_format = f"{endian}IIIIII"
+
+    sections = [struct.unpack_from(section_format, data, section_offset + section * section_size) for section in range(section_count)]
+    names_offset = sections[names_index][4] if names_index < section_count else None
+    for name_offset, section_type, flags, _, offset, size in sections:
+        name = b""
+        if names_offset is not None:
+            name = data[names_offset + name_offset:data.find(b"\0", names_offset + name_offset)]
+        yield name.decode(errors="replace"), section_type, flags, data[offset:offset + size]
+
+
+def _read_elf_build_id(data) -> Optional[str]:
+    endian = "<" if data[5] == 1 else ">"
+    for _, section_type, _, contents in _elf_sections(data):
+        if section_type != SHT_NOTE:
+            continue
+        position = 0
+        while position + 12 <= len(contents):
+            name_size, desc_size, note_type = struct.unpack_from(f"{endian}III", contents, position)
+            name = contents[position + 12:position + 12 + name_size]
+            desc_position = position + 12 + _align4(name_size)
+            if note_type == NT_GNU_BUILD_ID and name.rstrip(b"\0") == b"GNU":
+                return contents[desc_position:desc_position + desc_size].hex()
+            position = desc_position + _align4(desc_size)
+    return None
+
+
+def _decompress_elf_section(data, contents) -> Optional[bytes]:
+    ''' The contents of a SHF_COMPRESSED section, None when compressed with anything but zlib (e.g. zstd) '''
+    endian = "<" if data[5] == 1 else ">"
+    header_format = f"{endian}IIQQ" if data[4] == 2 else f"{endian}III"
+    if struct.unpack_from(f"{endian}I", contents)[0] != ELFCOMPRESS_ZLIB:
+        return None
+    return zlib.decompress(contents[struct.calcsize(header_format):])
+
+
+def has_split_debug_info(binary_path) -> bool:
+    '''
+    Whether an ELF binary was built with split debug info: its skeleton compilation units name the .dwo files holding
+    the actual debug info (DW_AT_dwo_name), which end up in the string section
+    '''
+    try:
+        with open(binary_path, "rb") as binary, mmap.mmap(binary.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:4] != b"\x7fELF":
+                return False
+            for name, _, flags, contents in _elf_sections(data):
+                if name != ".debug_str":
+                    continue
+                if flags & SHF_COMPRESSED:
+                    contents = _decompress_elf_section(data, contents) or b""
+                return b".dwo\0" in contents
+    except (OSError, ValueError, IndexError, struct.error, zlib.error):
+        pass
+    return False
+
+
+def _read_macho_uuid(data, offset=0) -> Optional[str]:
+    magic = data[offset:offset + 4]
+    if magic == b"\xca\xfe\xba\xbe":  # Universal binary, the debug id consists of the uuids of all architectures
+        arch_count, = struct.unpack_from(">I", data, offset + 4)
+        uuids = [_read_macho_uuid(data, struct.unpack_from(">I", data, offset + 8 + arch * 20 + 8)[0]) for arch in range(arch_count)]
+        return "-".join(uuid for uuid in uuids if uuid) or None
+
+    command_offset = offset + (32 if magic == b"\xcf\xfa\xed\xfe" else 28)
+    command_count, = struct.unpack_from("<I", data, offset + 16)
+    for _ in range(command_count):
+        command, command_size = struct.unpack_from("<II", data, command_offset)
+        if command == LC_UUID:
+            return data[command_offset + 8:command_offset + 24].hex()
+        command_offset += command_size
+    return None
+
+
+def read_debug_id(binary_path) -> Optional[str]:
+    '''
+    Reads the GNU build-id of an ELF binary or the UUID of a Mach-O binary, which identify the debug files of the binary.
+    Returns None for other (or invalid) files.
+    '''
+    try:
+        with open(binary_path, "rb") as binary, mmap.mmap(binary.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:4] == b"\x7fELF":
+                return _read_elf_build_id(data)
+            if data[:4] in (b"\xce\xfa\xed\xfe", b"\xcf\xfa\xed\xfe", b"\xca\xfe\xba\xbe"):
+                return _read_macho_uuid(data)
+    except (OSError, ValueError, struct.error):
+        pass
+    return None
+
+
+@contextmanager
+def _locked(lock_path):
+    '''
+    Holds an exclusive lock on the lock file while in the context, blocking until other processes release it
+    '''
+    with open(lock_path, "a+b") as lock_file:
+        if os.name == "nt":
+            import msvcrt
+            lock_file.seek(0)  # msvcrt locks the bytes from the current position
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after 10 attempts
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
 
 class SentryLibrary:
     options = {
@@ -14,12 +162,16 @@ class SentryLibrary:
         "sentry_send_binaries": [True, False],
         "sentry_create_release": [True, False],
         "sentry_project": ["ANY"],
+        "sentry_include_sources": ["all", "referenced"],
+        "sentry_debug_compression": ["zlib", "zstd"],
     }
     default_options = {
         "enable_sentry": False,
         "sentry_send_binaries": False,
         "sentry_create_release": False,
         "sentry_project": "",
+        "sentry_include_sources": "all",
+        "sentry_debug_compression": "zlib",
     }
 
     def config_options(self):
@@ -46,6 +198,34 @@ class SentryLibrary:
             self.requires("sentry-native/0.7.15")
             self.requires("libcurl/8.16.0#25c3bfc08d7e6a9aa4564a0fd20e9a21", override=True) # More recent version requires conan>=2.21.0
 
+    def _sentry_upload_ledger(self):
+        '''
+        The persistent ledger of the debug ids already uploaded to sentry, configured with user.sentry:upload_ledger
+        '''
+        default_ledger = Path.home().joinpath(".sentry", "uploaded_debug_files.json")
+        return Path(self.conf.get("user.sentry:upload_ledger", default=str(default_ledger), check_type=str))
+
+    def _load_sentry_upload_ledger(self):
+        ledger = self._sentry_upload_ledger()
+        if not ledger.exists():
+            return {}
+        try:
+            return json.loads(ledger.read_text())
+        except ValueError:
+            self.output.warning(f"Ignoring the invalid sentry upload ledger {ledger}")
+            return {}
+
+    def _record_sentry_upload(self, ledger_key, binary_name):
+        ledger = self._sentry_upload_ledger()
+        ledger.parent.mkdir(parents=True, exist_ok=True)
+        # Concurrent builds share the ledger, the lock keeps them from dropping each other's entries
+        with _locked(ledger.with_name(f"{ledger.name}.lock")):
+            uploads = self._load_sentry_upload_ledger()
+            uploads[ledger_key] = {"binary": binary_name, "uploaded": datetime.now(timezone.utc).isoformat()}
+            temporary_ledger = ledger.with_name(f"{ledger.name}.{os.getpid()}")
+            temporary_ledger.write_text(json.dumps(uploads, indent=2))
+            temporary_ledger.replace(ledger)  # Atomic, readers never see a partially written ledger
+
     def _sentry_environment(self):
         return self.conf.get("user.sentry:environment", default = 'development', check_type = str)
 
@@ -57,56 +237,184 @@ class SentryLibrary:
         cmake_toolchain.variables["SENTRY_URL"] = self.conf.get("user.sentry:url", "", check_type=str)
         cmake_toolchain.variables["SENTRY_ENVIRONMENT"] = self._sentry_environment()
 
-    def send_sentry_debug_files(self, binary_basename):
+    def _package_split_debug_info(self, binary_name):
         '''
-        Method to be called by actual packages at build() time, after the actual build has been done, to send the binary files to sentry
+        Packages the .dwo files of a binary built with split debug info (enable_split_debug_info) into a .dwp file next to
+        it, which is uploaded along with the binary. This has to be done before the debug info is stripped.
         '''
-        if self.options.enable_sentry and self.options.sentry_send_binaries:
-            sentry_project = self.options.sentry_project
-            sentry_organization = self.conf.get("user.sentry:organization", "", check_type=str)
-            sentry_token = self.conf.get("user.sentry:token", "", check_type=str)
+        dwp = which("llvm-dwp") or which("dwp")
+        if dwp is None:
+            raise ConanException("The binary has split debug info, but neither dwp nor llvm-dwp is installed to package it")
+        self.output.info("Packaging split debug info")
+        self.run(f"{dwp} -e {binary_name} -o {binary_name}.dwp")
+
+    def _sentry_auth(self):
+        sentry_organization = self.conf.get("user.sentry:organization", "", check_type=str)
+        sentry_token = self.conf.get("user.sentry:token", "", check_type=str)
+        return f"--auth-token {sentry_token} -o {sentry_organization} -p {self.options.sentry_project}"
+
+    def _sentry_ledger_key(self, debug_id):
+        sentry_organization = self.conf.get("user.sentry:organization", "", check_type=str)
+        return f"{sentry_organization}/{self.options.sentry_project}/{debug_id}"
+
+    def _run_sentry_cli(self, command):
+        '''
+        Runs a sentry-cli command, retried with an exponential backoff since uploads can fail on transient network errors
+        '''
+        retries = self.conf.get("user.sentry:upload_retries", default=3, check_type=int)
+        for attempt in range(retries + 1):
+            try:
+                self.run(f"sentry-cli {command} {self._sentry_auth()}")
+                return
+            except ConanException:
+                if attempt == retries:
+                    raise
+                delay = 2 ** attempt
+                self.output.warning(f"sentry-cli {' '.join(command.split()[:2])} failed, retrying in {delay}s")
+                time.sleep(delay)
+
+    def _sentry_binary_name(self, binary_basename):
+        if self.package_type == "application":
+            return binary_basename
+        if self.options.get_safe("shared", True):
+            extension = "dylib" if self.settings.os == "Macos" else "so"
+        else:
+            extension = "a"
+        return f"{binary_basename}.{extension}"
+
+    def _debug_sections_compression(self):
+        compression = str(self.options.sentry_debug_compression)
+        if compression == "zstd" and self.settings.os == "Linux":
+            objcopy_help = StringIO()
+            self.run("objcopy --help", stdout=objcopy_help, quiet=True)
+            if "zstd" not in objcopy_help.getvalue():
+                self.output.warning("objcopy doesn't support zstd compressed debug sections, using zlib instead")
+                return "zlib"
+        return compression
+
+    def _split_sentry_debug_files(self, binary_name, compression):
+        '''
+        Splits the debug info off the binary, returns the debug files to upload and the cleanup steps to run afterwards
+        '''
+        debug_files = []
+        cleanup_steps = []
+        if self.settings.os == "Linux":
+            if has_split_debug_info(binary_name):
+                self._package_split_debug_info(binary_name)
+                debug_files.append(f"{binary_name}.dwp")
+            self.output.info(f"Stripping debug symbols from {binary_name}")
+            self.run(f"objcopy --only-keep-debug --compress-debug-sections={compression} {binary_name} {binary_name}.debug")
+            self.run(f"objcopy --strip-debug --strip-unneeded {binary_name}")
+            self.run(f"objcopy --add-gnu-debuglink={binary_name}.debug {binary_name}")
+            debug_files.append(f"{binary_name}.debug")
+        elif self.settings.os == "Macos":
+            self.run(f"dsymutil {binary_name}")
+            debug_files.append(f"{binary_name}.dSYM")
+            cleanup_steps.append(f"rm -rf {binary_name}.dSYM") # Cleanup dsym directory after sending, other pyinstaller may pick it instead
+        return debug_files, cleanup_steps
+
+    def _upload_sentry_source_bundle(self, binary_name, debug_files):
+        # Only bundle the source files referenced by the compilation units in the debug files, instead of letting
+        # sentry-cli scan the whole source tree, including the dependencies and build artifacts
+        # sentry-cli writes a <debug file>.src.zip per debug file into the output folder
+        source_bundles = Path(f"{binary_name}.sources")
+        self.run(f"sentry-cli debug-files bundle-sources {' '.join(debug_files)} -o {source_bundles}")
+        bundles = " ".join(bundle.as_posix() for bundle in sorted(source_bundles.glob("*.src.zip")))
+        # The stripped binary itself is uploaded too, it holds the unwind info and symbol table needed to symbolicate
+        self._run_sentry_cli(f"debug-files upload {binary_name} {' '.join(debug_files)} {bundles}")
+        return f"rm -rf {source_bundles}"
+
+    def _process_sentry_debug_files(self, binary_basenames):
+        binary_names = [self._sentry_binary_name(binary_basename) for binary_basename in binary_basenames]
+        if not binary_names:
+            return
+        compression = self._debug_sections_compression()
+        uploaded = self._load_sentry_upload_ledger()
+        cleanup_steps = []
+
+        with ThreadPoolExecutor(max_workers=len(binary_names)) as executor:
+            split_debug_files = list(executor.map(lambda binary_name: self._split_sentry_debug_files(binary_name, compression), binary_names))
+            for _, binary_cleanup_steps in split_debug_files:
+                cleanup_steps += binary_cleanup_steps
+
+            # The debug id survives stripping, a known one means these debug files have already been uploaded
+            pending = []
+            for binary_name, (debug_files, _) in zip(binary_names, split_debug_files):
+                debug_id = read_debug_id(binary_name)
+                if debug_id is not None and self._sentry_ledger_key(debug_id) in uploaded:
+                    self.output.info(f"Debug symbols of {binary_name} ({debug_id}) have already been uploaded to sentry, skipping upload")
+                else:
+                    pending.append((binary_name, debug_files, debug_id))
+
+            if pending:
+                self.output.info("Uploading debug symbols to sentry")
+                bundled = [(binary_name, debug_files) for binary_name, debug_files, _ in pending if debug_files]
+                if self.options.sentry_include_sources == "referenced" and len(bundled) == len(pending):
+                    cleanup_steps += executor.map(lambda item: self._upload_sentry_source_bundle(*item), bundled)
+                else:
+                    build_source_dir = Path(self.build_folder).parent.parent.as_posix()
+                    self._run_sentry_cli(f"debug-files upload --include-sources {build_source_dir}")
+
+            for binary_name, _, debug_id in pending:
+                if debug_id is not None:
+                    self._record_sentry_upload(self._sentry_ledger_key(debug_id), binary_name)
+
+        for cleanup_step in cleanup_steps:
+            self.run(cleanup_step)
+
+    def _create_sentry_release(self, repository):
+        sentry_version = self.version
+        if self._sentry_environment() != "production":
+            sentry_version += f"+{self.conan_data['commit'][:6]}"
 
+        # create a sentry release and link it to the commit this is based upon
+        self.output.info(f"Creating a new release {sentry_version} in Sentry and linking it to the current commit {self.conan_data['commit']}")
+        self._run_sentry_cli(f"releases new {sentry_version}")
+        self._run_sentry_cli(f"releases set-commits {sentry_version} --commit \"Ultimaker/{repository}@{self.conan_data['commit']}\"")
+        self._run_sentry_cli(f"releases finalize {sentry_version}")
+
+    def start_sentry_debug_files(self, binary_basenames):
+        '''
+        Method to be called by actual packages at build() time, after the actual build has been done, to send the files of
+        several binaries to sentry. The debug info of the binaries is split off concurrently and uploaded in the background,
+        call wait_for_sentry_debug_files() at the end of build(). The binaries are stripped in the meantime, so they must
+        not be used, copied or moved until then.
+        '''
+        if self.options.enable_sentry and self.options.sentry_send_binaries:
             if which("sentry-cli") is None:
                 raise ConanException("sentry-cli is not installed, unable to upload debug symbols")
+            if getattr(self, "_sentry_processing", None) is not None:
+                raise ConanException("The debug files of the previous binaries are still being sent to sentry, call wait_for_sentry_debug_files() first")
 
-            if self.package_type == "application":
-                binary_name = binary_basename
-            else:
-                if self.options.get_safe("shared", True):
-                    extension = "dylib" if self.settings.os == "Macos" else "so"
-                else:
-                    extension = "a"
-                binary_name = f"{binary_basename}.{extension}"
-
-            cleanup_steps = []
-
-            if self.settings.os == "Linux":
-                self.output.info("Stripping debug symbols from binary")
-                self.run(f"objcopy --only-keep-debug --compress-debug-sections=zlib {binary_name} {binary_name}.debug")
-                self.run(f"objcopy --strip-debug --strip-unneeded {binary_name}")
-                self.run(f"objcopy --add-gnu-debuglink={binary_name}.debug {binary_name}")
-            elif self.settings.os == "Macos":
-                self.run(f"dsymutil {binary_name}")
-                cleanup_steps.append(f"rm -rf {binary_name}.dSYM") # Cleanup dsym directory after sending, other pyinstaller may pick it instead
-
-            self.output.info("Uploading debug symbols to sentry")
-            build_source_dir = Path(self.build_folder).parent.parent.as_posix()
-            sentry_auth = f"--auth-token {sentry_token} -o {sentry_organization} -p {sentry_project}"
-            self.run(f"sentry-cli debug-files upload --include-sources {build_source_dir} {sentry_auth}")
-
-            for cleanup_step in cleanup_steps:
-                self.run(cleanup_step)
-
-            if self.options.sentry_create_release:
-                sentry_version = self.version
-                if self._sentry_environment() != "production":
-                    sentry_version += f"+{self.conan_data['commit'][:6]}"
-
-                # create a sentry release and link it to the commit this is based upon
-                self.output.info(f"Creating a new release {sentry_version} in Sentry and linking it to the current commit {self.conan_data['commit']}")
-                self.run(f"sentry-cli releases new {sentry_version} {sentry_auth} ")
-                self.run(f"sentry-cli releases set-commits {sentry_version} --commit \"Ultimaker/{binary_basename}@{self.conan_data['commit']}\" {sentry_auth} ")
-                self.run(f"sentry-cli releases finalize {sentry_version} {sentry_auth} ")
+            # The binaries are relative to the build folder, which the background work must not depend on being the cwd
+            binary_basenames = [os.path.join(self.build_folder, binary_basename) for binary_basename in binary_basenames]
+            self._sentry_executor = ThreadPoolExecutor(max_workers=1)
+            self._sentry_processing = self._sentry_executor.submit(self._process_sentry_debug_files, binary_basenames)
+
+    def wait_for_sentry_debug_files(self, repository):
+        '''
+        Waits until the files started with start_sentry_debug_files() have been sent to sentry, then creates the release
+        linked to the current commit of the Ultimaker/<repository> repository if requested
+        '''
+        processing = getattr(self, "_sentry_processing", None)
+        if processing is None:
+            return
+
+        try:
+            processing.result()
+        finally:
+            self._sentry_executor.shutdown()
+            self._sentry_processing = None
+
+        if self.options.sentry_create_release:
+            self._create_sentry_release(repository)
+
+    def send_sentry_debug_files(self, binary_basename):
+        '''
+        Method to be called by actual packages at build() time, after the actual build has been done, to send the binary files to sentry
+        '''
+        self.start_sentry_debug_files([binary_basename])
+        self.wait_for_sentry_debug_files(repository=binary_basename)
 
 
 class PyReq(ConanFile):
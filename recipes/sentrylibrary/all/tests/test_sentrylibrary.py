@@ -0,0 +1,251 @@
+import importlib.util
+import json
+import re
+import shutil
+import struct
+import subprocess
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location("sentrylibrary_conanfile", Path(__file__).parents[1] / "conanfile.py")
+sentrylibrary = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(sentrylibrary)
+
+from conan.api.output import ConanOutput
+from conan.errors import ConanException
+from conans.model.conf import Conf
+
+
+class SentryConanFile(sentrylibrary.SentryLibrary):
+    ''' The parts of a conanfile used by SentryLibrary, for an application built in build_folder '''
+    package_type = "application"
+
+    def __init__(self, build_folder, ledger):
+        self.build_folder = str(build_folder)
+        self.options = SimpleNamespace(enable_sentry = True, sentry_send_binaries = True, sentry_create_release = False,
+                                       sentry_project = "cura", sentry_include_sources = "referenced",
+                                       sentry_debug_compression = "zlib")
+        self.settings = SimpleNamespace(os = "Linux")
+        self.conf = Conf()
+        self.conf.define("user.sentry:organization", "ultimaker")
+        self.conf.define("user.sentry:token", "token")
+        self.conf.define("user.sentry:upload_ledger", str(ledger))
+        self.conf.define("user.sentry:upload_retries", 0)
+        self.output = ConanOutput()
+
+    def run(self, command, stdout = None, quiet = False):
+        result = subprocess.run(command, shell = True, cwd = self.build_folder, stdout = subprocess.PIPE if stdout else None, text = True)
+        if stdout is not None:
+            stdout.write(result.stdout)
+        if result.returncode != 0:
+            raise ConanException(f"Error {result.returncode} while executing {command}")
+
+
+class SentryStandIn(BaseHTTPRequestHandler):
+    '''
+    The chunked debug file upload of the Sentry API: sentry-cli asks for the upload options, then asks the server to
+    assemble the debug files from their chunks, uploads the chunks that are missing and asks again
+    '''
+
+    def _reply(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path))
+        self._reply({"url": f"{self.server.url}/api/0/organizations/ultimaker/chunk-upload/", "chunkSize": 8 * 1024 * 1024,
+                     "chunksPerRequest": 64, "maxFileSize": 2 ** 31, "maxRequestSize": 32 * 1024 * 1024, "concurrency": 1,
+                     "hashAlgorithm": "sha1", "compression": [], "accept": ["debug_files", "sources"]})
+
+    def do_POST(self):
+        self.server.requests.append(("POST", self.path))
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.endswith("/chunk-upload/"):
+            # The chunks are sent as multipart form files named after their checksum
+            self.server.chunks.update(chunk.decode() for chunk in re.findall(rb'filename="([0-9a-f]{40})"', body))
+            self._reply({})
+        elif self.path == "/api/0/projects/ultimaker/cura/files/difs/assemble/":
+            response = {}
+            for checksum, debug_file in json.loads(body).items():
+                missing = [chunk for chunk in debug_file["chunks"] if chunk not in self.server.chunks]
+                response[checksum] = {"state": "not_found" if missing else "ok", "missingChunks": missing}
+                if not missing:
+                    self.server.assembled.append(debug_file["name"])
+                    debug_id = debug_file.get("debug_id", "00000000-0000-0000-0000-000000000000")
+                    response[checksum]["dif"] = {"id": "1", "uuid": debug_id, "debugId": debug_id, "objectName": debug_file["name"],
+                                                 "cpuName": "x86_64", "sha1": checksum, "data": {"features": []}}
+            self._reply(response)
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def sentry_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SentryStandIn)
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    server.requests, server.chunks, server.assembled = [], set(), []
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    monkeypatch.setenv("SENTRY_URL", server.url)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _elf(build_id = None, debug_str = b"", compress = False, bits = 64):
+    ''' A minimal little endian ELF file with a build-id note, a .debug_str and a section name table '''
+    names = b"\0.note.gnu.build-id\0.debug_str\0.shstrtab\0"
+    note = struct.pack("<III", 4, len(build_id), sentrylibrary.NT_GNU_BUILD_ID) + b"GNU\0" + build_id if build_id else b""
+    flags = 0
+    if compress:
+        header = struct.pack("<IIQQ", sentrylibrary.ELFCOMPRESS_ZLIB, 0, len(debug_str), 1) if bits == 64 else \
+            struct.pack("<III", sentrylibrary.ELFCOMPRESS_ZLIB, len(debug_str), 1)
+        debug_str, flags = header + zlib.compress(debug_str), sentrylibrary.SHF_COMPRESSED
+
+    header_size, section_header_size = (64, 64) if bits == 64 else (52, 40)
+    contents = [(0, 0, 0, b""), (names.index(b".note"), sentrylibrary.SHT_NOTE, 0, note),
+                (names.index(b".debug_str"), 1, flags, debug_str), (names.index(b".shstrtab"), 3, 0, names)]
+    data, section_headers = bytearray(header_size), []
+    for name, section_type, section_flags, section in contents:
+        if bits == 64:
+            section_headers.append(struct.pack("<IIQQQQIIQQ", name, section_type, section_flags, 0, len(data), len(section), 0, 0, 1, 0))
+        else:
+            section_headers.append(struct.pack("<IIIIIIIIII", name, section_type, section_flags, 0, len(data), len(section), 0, 0, 1, 0))
+        data += section
+
+    data[:6] = b"\x7fELF" + bytes([2 if bits == 64 else 1, 1])
+    if bits == 64:
+        struct.pack_into("<Q", data, 0x28, len(data))
+        struct.pack_into("<HHH", data, 0x3a, section_header_size, len(contents), len(contents) - 1)
+    else:
+        struct.pack_into("<I", data, 0x20, len(data))
+        struct.pack_into("<HHH", data, 0x2e, section_header_size, len(contents), len(contents) - 1)
+    return bytes(data + b"".join(section_headers))
+
+
+def _macho(uuid):
+    ''' A minimal 64 bits Mach-O file with a segment command followed by the LC_UUID command '''
+    segment = struct.pack("<II", 0x19, 72) + bytes(64)
+    return struct.pack("<IIIIIIII", 0xfeedfacf, 0x01000007, 3, 2, 2, len(segment) + 24, 0, 0) + segment + \
+        struct.pack("<II", sentrylibrary.LC_UUID, 24) + uuid
+
+
+def _universal(*architectures):
+    offsets, data = [], bytearray(8 + 20 * len(architectures))
+    for architecture in architectures:
+        data += bytes(-len(data) % 16)
+        offsets.append(len(data))
+        data += architecture
+    struct.pack_into(">II", data, 0, 0xcafebabe, len(architectures))
+    for index, (offset, architecture) in enumerate(zip(offsets, architectures)):
+        struct.pack_into(">IIIII", data, 8 + index * 20, 0x01000007, 3, offset, len(architecture), 4)
+    return bytes(data)
+
+
+@pytest.mark.parametrize("bits", [64, 32])
+def test_read_elf_build_id(tmp_path, bits):
+    binary = tmp_path / "binary"
+    binary.write_bytes(_elf(bytes.fromhex("0331719631b22abc669a8d7dd430de49fcc9aacc"), bits = bits))
+    assert sentrylibrary.read_debug_id(binary) == "0331719631b22abc669a8d7dd430de49fcc9aacc"
+
+
+def test_read_elf_without_build_id(tmp_path):
+    binary = tmp_path / "binary"
+    binary.write_bytes(_elf())
+    assert sentrylibrary.read_debug_id(binary) is None
+
+
+def test_read_macho_uuid(tmp_path):
+    binary = tmp_path / "binary"
+    binary.write_bytes(_macho(bytes(range(16))))
+    assert sentrylibrary.read_debug_id(binary) == bytes(range(16)).hex()
+
+
+def test_read_universal_macho_uuids(tmp_path):
+    binary = tmp_path / "binary"
+    binary.write_bytes(_universal(_macho(bytes(range(16))), _macho(bytes(range(16, 32)))))
+    assert sentrylibrary.read_debug_id(binary) == f"{bytes(range(16)).hex()}-{bytes(range(16, 32)).hex()}"
+
+
+@pytest.mark.parametrize("content", [b"", b"\x7fELF\x02\x01", b"\xcf\xfa\xed\xfe" + bytes(12), b"#!/bin/sh\n"])
+def test_read_invalid_debug_id(tmp_path, content):
+    binary = tmp_path / "binary"
+    binary.write_bytes(content)
+    assert sentrylibrary.read_debug_id(binary) is None
+    assert sentrylibrary.read_debug_id(tmp_path / "missing") is None
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("bits", [64, 32])
+def test_has_split_debug_info(tmp_path, compress, bits):
+    binary = tmp_path / "binary"
+    binary.write_bytes(_elf(debug_str = b"clang\0/build/main.dwo\0/build\0", compress = compress, bits = bits))
+    assert sentrylibrary.has_split_debug_info(binary)
+    binary.write_bytes(_elf(debug_str = b"clang\0/build/main.cpp\0/build\0", compress = compress, bits = bits))
+    assert not sentrylibrary.has_split_debug_info(binary)
+
+
+def test_ledger_records_uploads(tmp_path):
+    conanfile = SentryConanFile(tmp_path, tmp_path / "ledger" / "uploads.json")
+    assert conanfile._load_sentry_upload_ledger() == {}
+    conanfile._record_sentry_upload(conanfile._sentry_ledger_key("abc"), "app")
+    conanfile._record_sentry_upload(conanfile._sentry_ledger_key("def"), "lib.so")
+    assert set(conanfile._load_sentry_upload_ledger()) == {"ultimaker/cura/abc", "ultimaker/cura/def"}
+
+
+def test_ledger_ignores_invalid_file(tmp_path):
+    ledger = tmp_path / "uploads.json"
+    ledger.write_text("{")
+    conanfile = SentryConanFile(tmp_path, ledger)
+    assert conanfile._load_sentry_upload_ledger() == {}
+    conanfile._record_sentry_upload("ultimaker/cura/abc", "app")
+    assert list(conanfile._load_sentry_upload_ledger()) == ["ultimaker/cura/abc"]
+
+
+def _record_uploads(ledger, worker):
+    conanfile = SentryConanFile(ledger.parent, ledger)
+    for upload in range(20):
+        conanfile._record_sentry_upload(f"ultimaker/cura/{worker}-{upload}", "app")
+
+
+def test_ledger_concurrent_builds(tmp_path):
+    ledger = tmp_path / "uploads.json"
+    with ProcessPoolExecutor(max_workers = 8) as executor:
+        list(executor.map(_record_uploads, [ledger] * 8, range(8)))
+    assert len(json.loads(ledger.read_text())) == 8 * 20
+
+
+@pytest.mark.skipif(any(shutil.which(tool) is None for tool in ("gcc", "objcopy", "sentry-cli")), reason = "needs gcc, objcopy and sentry-cli")
+def test_upload_skips_known_debug_ids(tmp_path, sentry_server):
+    build_folder = tmp_path / "build"
+    build_folder.mkdir()
+    (build_folder / "main.c").write_text("int main(void) { return 0; }\n")
+    compile_app = ["gcc", "-g", "-Wl,--build-id", "main.c", "-o", "app"]
+    subprocess.run(compile_app, cwd = build_folder, check = True)
+    conanfile = SentryConanFile(build_folder, tmp_path / "uploads.json")
+
+    conanfile.start_sentry_debug_files(["app"])
+    conanfile.wait_for_sentry_debug_files("cura")
+    assert {"app", "app.debug", "app.src.zip"} <= set(sentry_server.assembled)
+    debug_id = sentrylibrary.read_debug_id(build_folder / "app")
+    assert list(conanfile._load_sentry_upload_ledger()) == [f"ultimaker/cura/{debug_id}"]
+    assert not (build_folder / "app.sources").exists()
+
+    # Rebuilding the same binary gives it the same build-id, which is known, so nothing is sent to sentry
+    sentry_server.requests.clear()
+    subprocess.run(compile_app, cwd = build_folder, check = True)
+    conanfile.send_sentry_debug_files("app")
+    assert sentry_server.requests == []
@@ -0,0 +1,105 @@
+# Generates the bindings of a sip module, run as a build step by add_sip_module(GENERATE) with:
+#   cmake -DSIP_BUILD_EXECUTABLE=<sip-build> -DMODULE_TARGET=<module> -DPROJECT_DIR=<dir> -DSIP_BUILD_DIR=<dir>
+#         -DSIP_WORK_DIR=<dir> -DSIP_FILES_LIST=<file> -DSIP_STAMP=<file> [-DSIP_INITIAL=ON] -P SIPGenerate.cmake
+# SIP_INITIAL is set by the generation done while configuring, when the list of generated files is still being made.
+#
+# sip-build empties its build-dir and doesn't accept --build-dir when the pyproject.toml sets it, so it runs on a scratch
+# copy of the pyproject.toml (<SIP_WORK_DIR>/project) that generates into <SIP_WORK_DIR>/generate. Only the generated
+# files with a changed content are copied to <SIP_BUILD_DIR>/<MODULE_TARGET>, after rewriting the paths in their #line
+# directives, to keep the recompilation to a minimum.
+cmake_minimum_required(VERSION 3.12)
+
+foreach(_sip_var SIP_BUILD_EXECUTABLE MODULE_TARGET PROJECT_DIR SIP_BUILD_DIR SIP_WORK_DIR SIP_FILES_LIST SIP_STAMP)
+    if(NOT DEFINED ${_sip_var})
+        message(FATAL_ERROR "SIP: ${_sip_var} is not set")
+    endif()
+endforeach()
+
+set(_sip_project_dir "${SIP_WORK_DIR}/project")
+set(_sip_generate_dir "${SIP_WORK_DIR}/generate")
+set(_sip_module_dir "${SIP_BUILD_DIR}/${MODULE_TARGET}")
+
+file(READ "${PROJECT_DIR}/pyproject.toml" _sip_pyproject)
+if(NOT _sip_pyproject MATCHES "\\[tool\\.sip\\.project\\]")
+    string(APPEND _sip_pyproject "\n[tool.sip.project]\n")
+endif()
+if(_sip_pyproject MATCHES "sip-files-dir[ \t]*=[ \t]*\"([^\"]*)\"")
+    get_filename_component(_sip_files_dir "${CMAKE_MATCH_1}" ABSOLUTE BASE_DIR "${PROJECT_DIR}")
+    string(REGEX REPLACE "sip-files-dir[ \t]*=[ \t]*\"[^\"]*\"" "sip-files-dir = \"${_sip_files_dir}\"" _sip_pyproject "${_sip_pyproject}")
+else()
+    string(REPLACE "[tool.sip.project]" "[tool.sip.project]\nsip-files-dir = \"${PROJECT_DIR}\"" _sip_pyproject "${_sip_pyproject}")
+endif()
+if(_sip_pyproject MATCHES "build-dir[ \t]*=")
+    string(REGEX REPLACE "build-dir[ \t]*=[ \t]*\"[^\"]*\"" "build-dir = \"${_sip_generate_dir}\"" _sip_pyproject "${_sip_pyproject}")
+else()
+    string(REPLACE "[tool.sip.project]" "[tool.sip.project]\nbuild-dir = \"${_sip_generate_dir}\"" _sip_pyproject "${_sip_pyproject}")
+endif()
+
+file(WRITE "${_sip_project_dir}/pyproject.toml" "${_sip_pyproject}")
+if(EXISTS "${PROJECT_DIR}/project.py")
+    file(COPY "${PROJECT_DIR}/project.py" DESTINATION "${_sip_project_dir}")
+endif()
+
+message(STATUS "SIP: Generating the bindings of ${MODULE_TARGET}")
+execute_process(COMMAND "${SIP_BUILD_EXECUTABLE}"
+        WORKING_DIRECTORY "${_sip_project_dir}"
+        RESULT_VARIABLE _sip_result
+        OUTPUT_VARIABLE _sip_output
+        ERROR_VARIABLE _sip_output)
+if(NOT _sip_result EQUAL 0)
+    message(FATAL_ERROR "SIP: sip-build failed for ${MODULE_TARGET}:\n${_sip_output}")
+endif()
+
+# Rewrite the #line directives in place, then copy per directory the files whose content changed
+file(GLOB_RECURSE _sip_generated RELATIVE "${_sip_generate_dir}/${MODULE_TARGET}" "${_sip_generate_dir}/${MODULE_TARGET}/*")
+list(SORT _sip_generated)
+set(_sip_subdirs)
+foreach(_sip_file ${_sip_generated})
+    set(_sip_path "${_sip_generate_dir}/${MODULE_TARGET}/${_sip_file}")
+    file(READ "${_sip_path}" _sip_content)
+    string(FIND "${_sip_content}" "${_sip_generate_dir}" _sip_found)
+    if(NOT _sip_found EQUAL -1)
+        string(REPLACE "${_sip_generate_dir}" "${SIP_BUILD_DIR}" _sip_content "${_sip_content}")
+        file(WRITE "${_sip_path}" "${_sip_content}")
+    endif()
+    get_filename_component(_sip_subdir "${_sip_file}" DIRECTORY)
+    if(NOT _sip_subdir)
+        set(_sip_subdir ".")
+    endif()
+    string(MAKE_C_IDENTIFIER "_sip_subdir_${_sip_subdir}" _sip_subdir_var)
+    list(APPEND ${_sip_subdir_var} "${_sip_path}")
+    list(APPEND _sip_subdirs "${_sip_subdir}")
+endforeach()
+list(REMOVE_DUPLICATES _sip_subdirs)
+foreach(_sip_subdir ${_sip_subdirs})
+    string(MAKE_C_IDENTIFIER "_sip_subdir_${_sip_subdir}" _sip_subdir_var)
+    file(MAKE_DIRECTORY "${_sip_module_dir}/${_sip_subdir}")
+    execute_process(COMMAND "${CMAKE_COMMAND}" -E copy_if_different ${${_sip_subdir_var}} "${_sip_module_dir}/${_sip_subdir}"
+            RESULT_VARIABLE _sip_result)
+    if(NOT _sip_result EQUAL 0)
+        message(FATAL_ERROR "SIP: Copying the generated files of ${MODULE_TARGET} failed")
+    endif()
+endforeach()
+
+# Only the directory of this module is cleaned, other modules may be generated next to it
+file(GLOB_RECURSE _sip_existing RELATIVE "${_sip_module_dir}" "${_sip_module_dir}/*")
+foreach(_sip_file ${_sip_existing})
+    if(NOT _sip_file IN_LIST _sip_generated)
+        file(REMOVE "${_sip_module_dir}/${_sip_file}")
+    endif()
+endforeach()
+
+# The generated files are declared to the build system when configuring, when sip generates another set of files (e.g.
+# because a class or a .sip file was added) the configuration has to be redone, which updating the list triggers
+string(REPLACE ";" "\n" _sip_files "${_sip_generated}")
+set(_sip_known_files)
+if(EXISTS "${SIP_FILES_LIST}")
+    file(READ "${SIP_FILES_LIST}" _sip_known_files)
+endif()
+if(NOT _sip_known_files STREQUAL _sip_files)
+    file(WRITE "${SIP_FILES_LIST}" "${_sip_files}")
+    if(NOT SIP_INITIAL)
+        message(FATAL_ERROR "SIP: The files generated for ${MODULE_TARGET} changed, run the build again to reconfigure")
+    endif()
+endif()
+file(TOUCH "${SIP_STAMP}")
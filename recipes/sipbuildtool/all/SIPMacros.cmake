@@ -1,7 +1,82 @@
 # TODO: Add this CMake build module to the sipbuildtool generator
 # ~~~~~~~~~~~~~~
 
+set(_SIP_GENERATE_SCRIPT "${CMAKE_CURRENT_LIST_DIR}/SIPGenerate.cmake")
+
+# Generates the bindings of MODULE_TARGET with sip-build as a build step (SIPGenerate.cmake), which reruns when the
+# pyproject.toml or the .sip files change. The generation and its scratch files are kept per module (sip_<module>) and
+# the sources end up in sip/<module>. The generated files need to be known when configuring, so the bindings are
+# generated once while configuring when they don't exist yet and declared as byproducts of the build step.
+function(_sip_generate MODULE_TARGET PROJECT_DIR SIP_FILES)
+    find_program(SIP_BUILD_EXECUTABLE sip-build)
+    if(NOT SIP_BUILD_EXECUTABLE)
+        message(FATAL_ERROR "SIP: sip-build not found, set SIP_BUILD_EXECUTABLE")
+    endif()
+
+    set(_sip_build_dir "${CMAKE_CURRENT_BINARY_DIR}/sip")
+    set(_sip_work_dir "${CMAKE_CURRENT_BINARY_DIR}/sip_${MODULE_TARGET}")
+    set(_sip_files_list "${_sip_work_dir}/files.txt")
+    set(_sip_stamp "${_sip_work_dir}/generate.stamp")
+    set(_sip_command "${CMAKE_COMMAND}"
+            "-DSIP_BUILD_EXECUTABLE=${SIP_BUILD_EXECUTABLE}"
+            "-DMODULE_TARGET=${MODULE_TARGET}"
+            "-DPROJECT_DIR=${PROJECT_DIR}"
+            "-DSIP_BUILD_DIR=${_sip_build_dir}"
+            "-DSIP_WORK_DIR=${_sip_work_dir}"
+            "-DSIP_FILES_LIST=${_sip_files_list}"
+            "-DSIP_STAMP=${_sip_stamp}")
+
+    if(NOT SIP_FILES)
+        file(READ "${PROJECT_DIR}/pyproject.toml" _sip_pyproject)
+        if(_sip_pyproject MATCHES "sip-files-dir[ \t]*=[ \t]*\"([^\"]*)\"")
+            get_filename_component(_sip_files_dir "${CMAKE_MATCH_1}" ABSOLUTE BASE_DIR "${PROJECT_DIR}")
+        else()
+            set(_sip_files_dir "${PROJECT_DIR}")
+        endif()
+        file(GLOB_RECURSE SIP_FILES CONFIGURE_DEPENDS "${_sip_files_dir}/*.sip")
+    endif()
+    set(_sip_inputs ${SIP_FILES} "${PROJECT_DIR}/pyproject.toml" "${_SIP_GENERATE_SCRIPT}")
+    if(EXISTS "${PROJECT_DIR}/project.py")
+        list(APPEND _sip_inputs "${PROJECT_DIR}/project.py")
+    endif()
+
+    if(NOT EXISTS "${_sip_files_list}" OR NOT EXISTS "${_sip_build_dir}/${MODULE_TARGET}")
+        execute_process(COMMAND ${_sip_command} -DSIP_INITIAL=ON -P "${_SIP_GENERATE_SCRIPT}" RESULT_VARIABLE _sip_result)
+        if(NOT _sip_result EQUAL 0)
+            message(FATAL_ERROR "SIP: Generating the bindings of ${MODULE_TARGET} failed")
+        endif()
+    endif()
+
+    # Updated by the build step when sip generates another set of files
+    set_property(DIRECTORY APPEND PROPERTY CMAKE_CONFIGURE_DEPENDS "${_sip_files_list}")
+    file(STRINGS "${_sip_files_list}" _sip_generated)
+    list(TRANSFORM _sip_generated PREPEND "${_sip_build_dir}/${MODULE_TARGET}/")
+
+    add_custom_command(OUTPUT "${_sip_stamp}"
+            BYPRODUCTS ${_sip_generated}
+            COMMAND ${_sip_command} -P "${_SIP_GENERATE_SCRIPT}"
+            DEPENDS ${_sip_inputs}
+            COMMENT "SIP: Generating the bindings of ${MODULE_TARGET}"
+            VERBATIM)
+    set(_sip_stamp "${_sip_stamp}" PARENT_SCOPE)
+endfunction()
+
+# add_sip_module(<MODULE_TARGET> [GENERATE] [PROJECT_DIR <dir>] [SIP_FILES <files>...]
+#                [PRECOMPILE_HEADERS] [UNITY_BUILD] [UNITY_BUILD_BATCH_SIZE <n>])
+#
+# Without GENERATE the bindings are expected to be generated by sip-build (SipBuildTool) before configuring. With
+# GENERATE they are generated by the build, and again whenever the pyproject.toml or the .sip files change:
+#   PROJECT_DIR: the folder containing the pyproject.toml, defaults to CMAKE_CURRENT_SOURCE_DIR
+#   SIP_FILES: the .sip input files, defaults to all the .sip files in the sip-files-dir of the pyproject.toml
+# In both cases the generated sources are collected from the sip build dir.
+#
+# The generated sources all include the same heavy headers, which can be parsed only once per module:
+#   PRECOMPILE_HEADERS: precompile the module API header (sipAPI<MODULE_TARGET>.h), which includes sip.h and Python.h
+#   UNITY_BUILD: batch the generated sources into unity translation units, UNITY_BUILD_BATCH_SIZE sources per unit
+#                (defaults to CMAKE_UNITY_BUILD_BATCH_SIZE). The sip runtime and user specified sources are never batched.
 function(add_sip_module MODULE_TARGET)
+    cmake_parse_arguments(PARSE_ARGV 1 _sip "GENERATE;PRECOMPILE_HEADERS;UNITY_BUILD" "PROJECT_DIR;UNITY_BUILD_BATCH_SIZE" "SIP_FILES")
+
     if(WIN32)
         set(ext .pyd)
         set(env_path_sep ";")
@@ -10,17 +85,22 @@ function(add_sip_module MODULE_TARGET)
         set(env_path_sep ":")
     endif()
 
-    # This will generate the source-files during the configuration step in CMake. Needed to obtain the sources
-
-    # Touch the generated files (8 in total) to make them dirty and force them to rebuild
-    message(STATUS "SIP: Touching the source files")
-    set(_sip_output_files)
-    list(LENGTH SIP_FILES _no_outputfiles)
-    foreach(_concat_file_nr RANGE 0 ${_no_outputfiles})
-        if(${_concat_file_nr} LESS 8)
-            list(APPEND _sip_output_files "${CMAKE_CURRENT_BINARY_DIR}/sip/${MODULE_TARGET}/sip${MODULE_TARGET}part${_concat_file_nr}.cpp")
+    if(_sip_GENERATE)
+        if(NOT _sip_PROJECT_DIR)
+            set(_sip_PROJECT_DIR "${CMAKE_CURRENT_SOURCE_DIR}")
         endif()
-    endforeach()
+        _sip_generate(${MODULE_TARGET} "${_sip_PROJECT_DIR}" "${_sip_SIP_FILES}")
+    else()
+        set(_sip_stamp)
+    endif()
+
+    # The sources have been generated before the configuration step in CMake. Needed to obtain the sources
+
+    # The number of concatenated part files depends on the `concatenate` setting of the bindings (py_sip_concatenate),
+    # capped by sip to the number of generated source files
+    file(GLOB _sip_output_files "${CMAKE_CURRENT_BINARY_DIR}/sip/${MODULE_TARGET}/sip${MODULE_TARGET}part*.cpp")
+    list(LENGTH _sip_output_files _no_outputfiles)
+    message(STATUS "SIP: Found ${_no_outputfiles} concatenated source files")
 
     # Find the generated source files
     message(STATUS "SIP: Collecting the generated source files")
@@ -37,7 +117,7 @@ function(add_sip_module MODULE_TARGET)
 
     # create the target library and link all the files (generated and user specified
     message(STATUS "SIP: Linking the interface target against the library")
-    set(sip_sources "${sip_c}" "${sip_cpp}" "${usr_src}" ${sip_hdr})
+    set(sip_sources "${sip_c}" "${sip_cpp}" "${usr_src}" ${sip_hdr} ${_sip_stamp})
 
     if (BUILD_SHARED_LIBS)
         add_library("sip_${MODULE_TARGET}" SHARED ${sip_sources})
@@ -45,6 +125,25 @@ function(add_sip_module MODULE_TARGET)
         add_library("sip_${MODULE_TARGET}" STATIC ${sip_sources})
     endif()
 
+    if(_sip_PRECOMPILE_HEADERS)
+        # Only the module API header, which defines PY_SSIZE_T_CLEAN and Py_LIMITED_API before including sip.h and Python.h
+        message(STATUS "SIP: Precompiling the module API header")
+        target_precompile_headers("sip_${MODULE_TARGET}" PRIVATE
+                "$<$<COMPILE_LANGUAGE:CXX>:${CMAKE_CURRENT_BINARY_DIR}/sip/${MODULE_TARGET}/sipAPI${MODULE_TARGET}.h>")
+    endif()
+
+    if(_sip_UNITY_BUILD)
+        message(STATUS "SIP: Batching the generated sources into unity translation units")
+        set_target_properties("sip_${MODULE_TARGET}" PROPERTIES UNITY_BUILD ON)
+        if(_sip_UNITY_BUILD_BATCH_SIZE)
+            set_target_properties("sip_${MODULE_TARGET}" PROPERTIES UNITY_BUILD_BATCH_SIZE ${_sip_UNITY_BUILD_BATCH_SIZE})
+        endif()
+        # The sip runtime sources define file-static helpers with clashing names, so only the part files are batched
+        if(usr_src OR sip_c)
+            set_source_files_properties(${usr_src} ${sip_c} PROPERTIES SKIP_UNITY_BUILD_INCLUSION ON)
+        endif()
+    endif()
+
     # Make sure that the library name of the target is the same as the MODULE_TARGET with the appropriate extension
     target_link_libraries("sip_${MODULE_TARGET}" PUBLIC "${MODULE_TARGET}")
     set_target_properties("sip_${MODULE_TARGET}" PROPERTIES PREFIX "")
@@ -1,12 +1,67 @@
+import functools
+import hashlib
 import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import StringIO
 from pathlib import Path
 
 from conan import ConanFile
-from conan.tools.files import chdir, copy
+from conan.errors import ConanException
+from conan.tools.build import build_jobs
+from conan.tools.files import copy
 
 from conan.tools.microsoft.subsystems import unix_path
 
 
+_TOML_SECTION = re.compile(r"^\s*\[([^\[\]]+)\]\s*$")
+_TOML_KEY = re.compile(r"^\s*([A-Za-z0-9_-]+)\s*=\s*(.*?)\s*$")
+
+
+def get_project_option(content: str, name: str):
+    """ Returns the string value of an option in the [tool.sip.project] section of a pyproject.toml, None if not set """
+    section = None
+    for line in content.splitlines():
+        header = _TOML_SECTION.match(line)
+        if header:
+            section = header.group(1).strip()
+            continue
+        key = _TOML_KEY.match(line)
+        if section == "tool.sip.project" and key and key.group(1) == name:
+            return key.group(2).strip("\"'")
+    return None
+
+
+def set_project_options(content: str, options: dict) -> str:
+    """ Sets (string) options in the [tool.sip.project] section of a pyproject.toml, adding the section when missing """
+    lines = []
+    remaining = dict(options)
+    in_section = False
+    for line in content.splitlines():
+        header = _TOML_SECTION.match(line)
+        if header:
+            if in_section:
+                lines.extend(f'{name} = "{value}"' for name, value in remaining.items())
+                remaining.clear()
+            in_section = header.group(1).strip() == "tool.sip.project"
+        else:
+            key = _TOML_KEY.match(line)
+            if in_section and key and key.group(1) in remaining:
+                line = f'{key.group(1)} = "{remaining.pop(key.group(1))}"'
+        lines.append(line)
+    if remaining:
+        if not in_section:
+            lines.append("[tool.sip.project]")
+        lines.extend(f'{name} = "{value}"' for name, value in remaining.items())
+    return "\n".join(lines) + "\n"
+
+
+def set_bindings_name(content: str, name: str) -> str:
+    """ Renames the [tool.sip.bindings.<name>] section of a pyproject.toml, sip expects a <name>.sip in sip-files-dir """
+    return re.sub(r"^\[tool\.sip\.bindings\.[^\]]+\]", f"[tool.sip.bindings.{name}]", content, count=1, flags=re.MULTILINE)
+
+
 class SipBuildTool(object):
     """
     A build tool for sip
@@ -17,6 +72,11 @@ class SipBuildTool(object):
     sip = self.python_requires["sipbuildtool"].module.SipBuildTool(self)
     sip.configure()
     sip.generate("projectName")
+
+    The code generation is skipped when none of its inputs changed since the previous build. Otherwise sip-build, which
+    empties its build-dir, runs on a scratch copy of the pyproject.toml ("<build dir>.project") that generates into
+    "<build dir>.generate", and only the generated files with a changed content are replaced in the build dir. Paths in
+    the pyproject.toml other than sip-files-dir have to be absolute, as written by the PyProjectToolchain.
     """
 
     def __init__(self, conanfile: ConanFile):
@@ -51,20 +111,153 @@ class SipBuildTool(object):
                 else:
                     self._conanfile.output.warning(f"sip-build not found at expected path: {sip_path}")
 
-    def build(self):
-        with chdir(self, self._conanfile.source_folder):
-            sip_cmd = self._sip_install_executable
-            subsystem = unix_path(self._conanfile, ".")
-            sip_cmd = str(Path(subsystem).joinpath(sip_cmd))
-            cmd = '"{}"'.format(sip_cmd)
-            self._conanfile.output.info(f"Calling:\n > {cmd}")
-            self._conanfile.run(cmd)
+    @property
+    def _sip_cmd(self) -> str:
+        subsystem = unix_path(self._conanfile, ".")
+        return '"{}"'.format(str(Path(subsystem).joinpath(self._sip_install_executable)))
+
+    @functools.cached_property
+    def _sip_version(self) -> str:
+        output = StringIO()
+        self._conanfile.run(f"{self._sip_cmd} -V", stdout=output)
+        return output.getvalue().strip()
+
+    def _fingerprint(self, pyproject: str, project_dir: Path, sip_files_dir: Path) -> str:
+        """ Hash over all the inputs of the code generation: sip files, pyproject.toml, sip version and dependencies """
+        fingerprint = hashlib.sha256()
+        fingerprint.update(self._sip_version.encode())
+        fingerprint.update(pyproject.encode())
+
+        input_files = [project_dir / "project.py"] + sorted(sip_files_dir.rglob("*.sip"))
+        for input_file in filter(Path.exists, input_files):
+            fingerprint.update(input_file.as_posix().encode())
+            fingerprint.update(input_file.read_bytes())
+
+        # The package reference contains the revision and package id, which change when the headers change
+        for dependency in self._conanfile.dependencies.host.values():
+            fingerprint.update(str(dependency.pref).encode())
+        return fingerprint.hexdigest()
+
+    def _replace_changed_files(self, generated_dir: Path, build_dir: Path) -> None:
+        """
+        Writes the generated files with a changed content to the build dir and removes the ones no longer generated. The
+        #line directives of the generated sources refer to their own path, which is rewritten to the build dir first.
+        """
+        generated_path, build_path = generated_dir.as_posix().encode(), build_dir.as_posix().encode()
+        generated_files = {path.relative_to(generated_dir) for path in generated_dir.rglob("*") if path.is_file()}
+        replaced = 0
+        for relative_path in sorted(generated_files):
+            content = (generated_dir / relative_path).read_bytes().replace(generated_path, build_path)
+            build_file = build_dir / relative_path
+            if build_file.exists() and build_file.read_bytes() == content:
+                continue
+            build_file.parent.mkdir(parents=True, exist_ok=True)
+            build_file.write_bytes(content)
+            replaced += 1
+
+        for build_file in [path for path in build_dir.rglob("*") if path.is_file()]:
+            if build_file.relative_to(build_dir) not in generated_files:
+                build_file.unlink()
+        self._conanfile.output.info(f"Replaced {replaced} of {len(generated_files)} generated files in {build_dir}")
+
+    def _build_project(self, project_dir: Path, build_dir: Path, pyproject=None, log=None) -> None:
+        """
+        Generates the code of the project in project_dir into build_dir, from the pyproject.toml content when given,
+        otherwise from the pyproject.toml in project_dir
+        """
+        if pyproject is None:
+            pyproject = (project_dir / "pyproject.toml").read_text(encoding="utf-8")
+        sip_files_dir = project_dir / (get_project_option(pyproject, "sip-files-dir") or ".")
+        generate_dir = build_dir.with_name(f"{build_dir.name}.generate")
+        scratch_dir = build_dir.with_name(f"{build_dir.name}.project")
+        # sip-build doesn't accept --build-dir when the pyproject.toml sets it, and resolves relative paths against its
+        # working dir
+        pyproject = set_project_options(pyproject, {"build-dir": generate_dir.as_posix(),
+                                                    "sip-files-dir": sip_files_dir.resolve().as_posix()})
+
+        fingerprint_file = build_dir.with_name(f"{build_dir.name}.fingerprint")
+        fingerprint = self._fingerprint(pyproject, project_dir, sip_files_dir)
+        if build_dir.exists() and fingerprint_file.exists() and fingerprint_file.read_text() == fingerprint:
+            self._conanfile.output.info(f"The sip inputs are unchanged, reusing the generated code in {build_dir}")
+            return
+
+        scratch_dir.mkdir(parents=True, exist_ok=True)
+        (scratch_dir / "pyproject.toml").write_text(pyproject, encoding="utf-8")
+        if (project_dir / "project.py").exists():
+            shutil.copy2(project_dir / "project.py", scratch_dir / "project.py")
+
+        cmd = self._sip_cmd
+        self._conanfile.output.info(f"Calling:\n > {cmd}")
+        self._conanfile.run(cmd, cwd=str(scratch_dir), stdout=log, stderr=log)
+        self._replace_changed_files(generate_dir, build_dir)
+
+        fingerprint_file.write_text(fingerprint)
+
+    def build(self, build_dir=None):
+        """
+        Generates the bindings with sip-build
+
+        Args:
+            build_dir: The build dir of the sip project, defaults to the "sip" folder in the build folder, which is the
+                build-dir set by the PyProjectToolchain
+        """
+        self._build_project(Path(self._conanfile.source_folder),
+                            Path(build_dir or Path(self._conanfile.build_folder, "sip")))
+
+    def build_modules(self, project_dirs, max_workers=None):
+        """
+        Generates the bindings of several sip modules concurrently. A project dir with its own pyproject.toml is built
+        as is. Otherwise its pyproject.toml is derived from the one the PyProjectToolchain generated in the source folder:
+        sip-files-dir is set to the project dir and the bindings are renamed to the name of the project dir, which has
+        to contain the matching <name>.sip. The output of each sip-build is captured in a log file next to its build dir.
+
+        Args:
+            project_dirs: The project dirs, relative to the source folder. The build dir of each project is the "sip"
+                folder in the matching subdirectory of the build folder, i.e. the CMAKE_CURRENT_BINARY_DIR of a project
+                added with add_subdirectory(), as expected by add_sip_module
+            max_workers: The maximum number of concurrent builds, defaults to the number of build jobs
+        """
+        max_workers = max_workers or build_jobs(self._conanfile)
+        self._sip_version  # Resolve it once before starting the workers
+        toolchain_pyproject = Path(self._conanfile.source_folder, "pyproject.toml")
+
+        def build_module(project_dir):
+            source_dir = Path(self._conanfile.source_folder, project_dir)
+            build_dir = Path(self._conanfile.build_folder, project_dir, "sip")
+            pyproject = None
+            if not (source_dir / "pyproject.toml").exists():
+                pyproject = set_bindings_name(toolchain_pyproject.read_text(encoding="utf-8"), source_dir.name)
+                pyproject = set_project_options(pyproject, {"sip-files-dir": source_dir.as_posix()})
+
+            log_file = build_dir.with_name(f"{build_dir.name}.log")
+            log = StringIO()
+            try:
+                self._build_project(source_dir, build_dir, pyproject=pyproject, log=log)
+            finally:
+                if log.getvalue():
+                    log_file.parent.mkdir(parents=True, exist_ok=True)
+                    log_file.write_text(log.getvalue())
+
+        failures = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(build_module, project_dir): project_dir for project_dir in project_dirs}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    self._conanfile.output.info(f"Generated the bindings of {futures[future]}")
+                except Exception as e:
+                    failures[futures[future]] = e
+
+        if failures:
+            for project_dir, error in failures.items():
+                self._conanfile.output.error(f"Generating the bindings of {project_dir} failed: {error}")
+            raise ConanException(f"sip-build failed for: {', '.join(str(project_dir) for project_dir in failures)}")
 
 
 class Pkg(ConanFile):
     name = "sipbuildtool"
     package_type = "build-scripts"
-    exports_sources = "SIPMacros.cmake"
+    exports_sources = "SIPMacros.cmake", "SIPGenerate.cmake"
 
     def package(self):
         copy(self, pattern="*.cmake", src=self.export_sources_folder, dst=os.path.join(self.package_folder, "cmake"))
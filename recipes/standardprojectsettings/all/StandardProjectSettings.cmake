@@ -1,5 +1,7 @@
 include(GNUInstallDirs) # Standard install dirs
 
+set(STANDARD_PROJECT_SETTINGS_DIR "${CMAKE_CURRENT_LIST_DIR}")
+
 # Generate compile_commands.json to make it easier to work with clang based tools
 message(STATUS "Generating compile commands to ${CMAKE_CURRENT_BINARY_DIR}/compile_commands.json")
 set(CMAKE_EXPORT_COMPILE_COMMANDS ON)
@@ -178,6 +180,260 @@ function(enable_sanitizers project_name)
 
 endfunction()
 
+# Route the compilation through ccache or sccache, whichever is found first
+function(enable_compiler_cache project_name)
+    option(ENABLE_COMPILER_CACHE "Enable compiler caching with ccache or sccache" ON)
+    if(NOT ENABLE_COMPILER_CACHE)
+        return()
+    endif()
+
+    get_target_property(type ${project_name} TYPE)
+    if (${type} STREQUAL "INTERFACE_LIBRARY")
+        message(STATUS "Not enabling the compiler cache for interface library ${project_name}")
+        return()
+    endif()
+
+    find_program(COMPILER_CACHE_PROGRAM NAMES ccache sccache)
+    if(COMPILER_CACHE_PROGRAM)
+        message(STATUS "Using compiler cache ${COMPILER_CACHE_PROGRAM} for ${project_name}")
+        set_target_properties(${project_name} PROPERTIES
+                C_COMPILER_LAUNCHER ${COMPILER_CACHE_PROGRAM}
+                CXX_COMPILER_LAUNCHER ${COMPILER_CACHE_PROGRAM})
+    else()
+        message(WARNING "Compiler cache requested but no ccache or sccache executable found")
+    endif()
+endfunction()
+
+# Link with mold or lld instead of the default linker, whichever is found first and supported by the compiler
+function(use_fast_linker project_name)
+    option(USE_FAST_LINKER "Link with mold or lld when available" ON)
+    if(NOT USE_FAST_LINKER OR MSVC)
+        return()
+    endif()
+
+    include(CheckLinkerFlag)
+    foreach(linker mold lld)
+        string(TOUPPER ${linker} linker_upper)
+        check_linker_flag(CXX "-fuse-ld=${linker}" HAVE_LINKER_${linker_upper})
+        if(HAVE_LINKER_${linker_upper})
+            message(STATUS "Using the ${linker} linker for ${project_name}")
+            get_target_property(type ${project_name} TYPE)
+            if (${type} STREQUAL "INTERFACE_LIBRARY")
+                target_link_options(${project_name} INTERFACE -fuse-ld=${linker})
+            else()
+                target_link_options(${project_name} PRIVATE -fuse-ld=${linker})
+            endif()
+            return()
+        endif()
+    endforeach()
+    message(STATUS "No fast linker found for ${project_name}, using the default linker")
+endfunction()
+
+# Batch the sources of the target into unity translation units of batch_size sources
+function(enable_unity_build project_name batch_size)
+    option(ENABLE_UNITY_BUILD "Enable unity builds" OFF)
+    if(ENABLE_UNITY_BUILD)
+        message(STATUS "Enabling unity build for ${project_name} with batches of ${batch_size} sources")
+        set_target_properties(${project_name} PROPERTIES
+                UNITY_BUILD ON
+                UNITY_BUILD_BATCH_SIZE ${batch_size})
+    endif()
+endfunction()
+
+# Precompile the given headers (remaining arguments), e.g. enable_precompiled_headers(${PROJECT_NAME} <vector> "include/heavy.h")
+function(enable_precompiled_headers project_name)
+    option(ENABLE_PRECOMPILED_HEADERS "Enable precompiled headers" ON)
+    if(NOT ENABLE_PRECOMPILED_HEADERS)
+        return()
+    endif()
+
+    get_target_property(type ${project_name} TYPE)
+    if (${type} STREQUAL "INTERFACE_LIBRARY")
+        message(STATUS "Not precompiling headers for interface library ${project_name}")
+    else()
+        message(STATUS "Precompiling headers for ${project_name}: ${ARGN}")
+        target_precompile_headers(${project_name} PRIVATE ${ARGN})
+    endif()
+endfunction()
+
+# Enable link time optimization, using ThinLTO with clang
+function(enable_lto project_name)
+    option(ENABLE_LTO "Enable link time optimization" OFF)
+    if(NOT ENABLE_LTO)
+        return()
+    endif()
+
+    include(CheckIPOSupported)
+    check_ipo_supported(RESULT ipo_supported OUTPUT ipo_output)
+    if(NOT ipo_supported)
+        message(WARNING "Link time optimization is not supported: ${ipo_output}")
+        return()
+    endif()
+
+    get_target_property(type ${project_name} TYPE)
+    if(CMAKE_CXX_COMPILER_ID MATCHES ".*Clang" AND NOT MSVC)
+        message(STATUS "Enabling ThinLTO for ${project_name}")
+        if (${type} STREQUAL "INTERFACE_LIBRARY")
+            target_compile_options(${project_name} INTERFACE -flto=thin)
+            target_link_options(${project_name} INTERFACE -flto=thin)
+        else()
+            target_compile_options(${project_name} PRIVATE -flto=thin)
+            target_link_options(${project_name} PRIVATE -flto=thin)
+        endif()
+    elseif (${type} STREQUAL "INTERFACE_LIBRARY")
+        message(STATUS "Not enabling link time optimization for interface library ${project_name}")
+    else()
+        message(STATUS "Enabling link time optimization for ${project_name}")
+        set_target_properties(${project_name} PROPERTIES INTERPROCEDURAL_OPTIMIZATION ON)
+    endif()
+endfunction()
+
+# Two-phase profile guided optimization, switched by PGO_MODE:
+#   generate: instrument the target, running it writes the profiles to PGO_PROFILE_DIR
+#   use: optimize the target with the profiles in PGO_PROFILE_DIR, clang .profraw files are merged automatically
+function(enable_pgo project_name)
+    set(PGO_MODE "" CACHE STRING "Profile guided optimization mode: generate, use or empty to disable")
+    set_property(CACHE PGO_MODE PROPERTY STRINGS "" generate use)
+    set(PGO_PROFILE_DIR "${CMAKE_BINARY_DIR}/pgo" CACHE PATH "Directory of the profile guided optimization profiles")
+    if(PGO_MODE STREQUAL "")
+        return()
+    endif()
+
+    if(NOT CMAKE_CXX_COMPILER_ID STREQUAL "GNU" AND NOT (CMAKE_CXX_COMPILER_ID MATCHES ".*Clang" AND NOT MSVC))
+        message(WARNING "Profile guided optimization is not supported for the '${CMAKE_CXX_COMPILER_ID}' compiler")
+        return()
+    endif()
+
+    if(PGO_MODE STREQUAL "generate")
+        message(STATUS "Instrumenting ${project_name} to generate profiles in ${PGO_PROFILE_DIR}")
+        file(MAKE_DIRECTORY "${PGO_PROFILE_DIR}")
+        set(PGO_COMPILE_OPTIONS -fprofile-generate=${PGO_PROFILE_DIR})
+        set(PGO_LINK_OPTIONS -fprofile-generate=${PGO_PROFILE_DIR})
+    elseif(PGO_MODE STREQUAL "use")
+        if(CMAKE_CXX_COMPILER_ID STREQUAL "GNU")
+            file(GLOB_RECURSE gcda_files "${PGO_PROFILE_DIR}/*.gcda")
+            if(NOT gcda_files)
+                message(FATAL_ERROR "No GCC profiles (*.gcda) found in ${PGO_PROFILE_DIR}, build and run with PGO_MODE=generate first")
+            endif()
+            # A profile that doesn't match the sources (coverage-mismatch) is an error by default
+            set(PGO_COMPILE_OPTIONS -fprofile-use=${PGO_PROFILE_DIR} -fprofile-correction -Werror=coverage-mismatch)
+        else()
+            set(profdata "${PGO_PROFILE_DIR}/default.profdata")
+            file(GLOB profraw_files "${PGO_PROFILE_DIR}/*.profraw")
+            if(profraw_files)
+                get_filename_component(compiler_dir "${CMAKE_CXX_COMPILER}" DIRECTORY)
+                find_program(LLVM_PROFDATA NAMES llvm-profdata HINTS "${compiler_dir}")
+                if(NOT LLVM_PROFDATA)
+                    message(FATAL_ERROR "llvm-profdata not found, unable to merge the clang profiles in ${PGO_PROFILE_DIR}")
+                endif()
+                execute_process(COMMAND "${LLVM_PROFDATA}" merge -output=${profdata} ${profraw_files}
+                        RESULT_VARIABLE merge_result)
+                if(NOT merge_result EQUAL 0)
+                    message(FATAL_ERROR "Merging the clang profiles in ${PGO_PROFILE_DIR} failed")
+                endif()
+            endif()
+            if(NOT EXISTS "${profdata}")
+                message(FATAL_ERROR "No clang profile (default.profdata or *.profraw) found in ${PGO_PROFILE_DIR}, build and run with PGO_MODE=generate first")
+            endif()
+            # A profile that doesn't match the sources anymore is stale
+            set(PGO_COMPILE_OPTIONS -fprofile-use=${profdata} -Werror=profile-instr-out-of-date)
+        endif()
+        message(STATUS "Optimizing ${project_name} with the profiles in ${PGO_PROFILE_DIR}")
+        set(PGO_LINK_OPTIONS ${PGO_COMPILE_OPTIONS})
+    else()
+        message(FATAL_ERROR "Unknown PGO_MODE '${PGO_MODE}', use generate, use or leave it empty")
+    endif()
+
+    get_target_property(type ${project_name} TYPE)
+    if (${type} STREQUAL "INTERFACE_LIBRARY")
+        target_compile_options(${project_name} INTERFACE ${PGO_COMPILE_OPTIONS})
+        target_link_options(${project_name} INTERFACE ${PGO_LINK_OPTIONS})
+    else()
+        target_compile_options(${project_name} PRIVATE ${PGO_COMPILE_OPTIONS})
+        target_link_options(${project_name} PRIVATE ${PGO_LINK_OPTIONS})
+    endif()
+endfunction()
+
+# Profile the compilation of the target. Clang writes a -ftime-trace JSON file next to every object file, these are
+# aggregated into a ranked report of the most expensive headers, templates and translation units by building the
+# build_time_report target. GCC prints a -ftime-report for every translation unit in the build log.
+function(enable_build_time_profiling project_name)
+    option(ENABLE_BUILD_TIME_PROFILING "Enable compile time profiling" OFF)
+    if(NOT ENABLE_BUILD_TIME_PROFILING)
+        return()
+    endif()
+
+    if(CMAKE_CXX_COMPILER_ID MATCHES ".*Clang" AND NOT MSVC)
+        set(PROFILING_OPTIONS -ftime-trace)
+    elseif(CMAKE_CXX_COMPILER_ID STREQUAL "GNU")
+        set(PROFILING_OPTIONS -ftime-report)
+    else()
+        message(WARNING "Compile time profiling is not supported for the '${CMAKE_CXX_COMPILER_ID}' compiler")
+        return()
+    endif()
+
+    message(STATUS "Enabling compile time profiling for ${project_name}")
+    get_target_property(type ${project_name} TYPE)
+    if (${type} STREQUAL "INTERFACE_LIBRARY")
+        target_compile_options(${project_name} INTERFACE ${PROFILING_OPTIONS})
+    else()
+        target_compile_options(${project_name} PRIVATE ${PROFILING_OPTIONS})
+    endif()
+
+    if(PROFILING_OPTIONS STREQUAL "-ftime-trace" AND NOT TARGET build_time_report)
+        find_package(Python3 COMPONENTS Interpreter QUIET)
+        find_file(BUILD_TIME_REPORT_SCRIPT build_time_report.py
+                PATHS "${STANDARD_PROJECT_SETTINGS_DIR}" "${STANDARD_PROJECT_SETTINGS_DIR}/../../bin" NO_DEFAULT_PATH)
+        if(Python3_Interpreter_FOUND AND BUILD_TIME_REPORT_SCRIPT)
+            add_custom_target(build_time_report
+                    COMMAND Python3::Interpreter "${BUILD_TIME_REPORT_SCRIPT}" "${CMAKE_BINARY_DIR}" --json "${CMAKE_BINARY_DIR}/build_time_report.json"
+                    COMMENT "Aggregating the compile time traces"
+                    VERBATIM)
+        else()
+            message(WARNING "Python or build_time_report.py not found, run build_time_report.py on the build folder manually")
+        endif()
+    endif()
+endfunction()
+
+# Keep the DWARF debug info out of the objects and the linked binary (.dwo files next to the objects), compress the
+# debug sections and let the linker build a gdb index, which considerably speeds up linking large binaries with debug
+# info. The .dwo files can be packaged into a .dwp file with dwp (SentryLibrary does this before uploading).
+function(enable_split_debug_info project_name)
+    option(ENABLE_SPLIT_DEBUG_INFO "Enable split DWARF debug info" OFF)
+    if(NOT ENABLE_SPLIT_DEBUG_INFO)
+        return()
+    endif()
+
+    if(NOT (CMAKE_CXX_COMPILER_ID STREQUAL "GNU" OR CMAKE_CXX_COMPILER_ID MATCHES ".*Clang") OR APPLE OR WIN32)
+        message(WARNING "Split debug info is only supported for ELF targets with gcc or clang")
+        return()
+    endif()
+
+    include(CheckCXXCompilerFlag)
+    include(CheckLinkerFlag)
+    set(SPLIT_DEBUG_COMPILE_OPTIONS -gsplit-dwarf)
+    set(SPLIT_DEBUG_LINK_OPTIONS)
+    check_cxx_compiler_flag(-gz HAVE_COMPRESSED_DEBUG_SECTIONS)
+    if(HAVE_COMPRESSED_DEBUG_SECTIONS)
+        list(APPEND SPLIT_DEBUG_COMPILE_OPTIONS -gz)
+        list(APPEND SPLIT_DEBUG_LINK_OPTIONS -gz)
+    endif()
+    check_linker_flag(CXX "LINKER:--gdb-index" HAVE_LINKER_GDB_INDEX) # Not supported by GNU ld, only by gold, lld and mold
+    if(HAVE_LINKER_GDB_INDEX)
+        list(APPEND SPLIT_DEBUG_LINK_OPTIONS "LINKER:--gdb-index")
+    endif()
+
+    message(STATUS "Enabling split debug info for ${project_name}")
+    get_target_property(type ${project_name} TYPE)
+    if (${type} STREQUAL "INTERFACE_LIBRARY")
+        target_compile_options(${project_name} INTERFACE ${SPLIT_DEBUG_COMPILE_OPTIONS})
+        target_link_options(${project_name} INTERFACE ${SPLIT_DEBUG_LINK_OPTIONS})
+    else()
+        target_compile_options(${project_name} PRIVATE ${SPLIT_DEBUG_COMPILE_OPTIONS})
+        target_link_options(${project_name} PRIVATE ${SPLIT_DEBUG_LINK_OPTIONS})
+    endif()
+endfunction()
+
 option(ENABLE_CPPCHECK "Enable static analysis with cppcheck" OFF)
 option(ENABLE_CLANG_TIDY "Enable static analysis with clang-tidy" OFF)
 option(ENABLE_INCLUDE_WHAT_YOU_USE "Enable static analysis with include-what-you-use" OFF)
@@ -0,0 +1,98 @@
+"""
+Aggregates the clang -ftime-trace JSON files in a build folder into a ranked report of the most expensive headers,
+template instantiations and translation units. Enable the traces with enable_build_time_profiling() from
+StandardProjectSettings.cmake, build, and run this script on the build folder:
+
+  build_time_report.py <build_folder> [--top N] [--json report.json]
+"""
+import argparse
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
+
+# Trace events aggregated per detail (the header or template name), durations are in microseconds
+CATEGORIES = {
+    "Source": "headers",
+    "InstantiateClass": "templates",
+    "InstantiateFunction": "templates",
+}
+
+
+def load_traces(build_folder: Path) -> Iterator[Tuple[Path, Dict[str, Any]]]:
+    for trace_file in sorted(build_folder.rglob("*.json")):
+        try:
+            trace = json.loads(trace_file.read_text(encoding = "utf-8"))
+        except (ValueError, UnicodeDecodeError):
+            continue
+        if isinstance(trace, dict) and "traceEvents" in trace:
+            yield trace_file, trace
+
+
+def durations(events) -> Iterator[Tuple[str, Dict[str, Any], float]]:
+    """
+    The name, args and duration in milliseconds of the complete events ('X') and of the async events, which recent
+    clang versions emit for Source as begin ('b') and end ('e') pairs matched by their id
+    """
+    begun = defaultdict(list)
+    for event in events:
+        phase = event.get("ph")
+        if phase == "X":
+            yield event.get("name"), event.get("args", {}), event.get("dur", 0) / 1000.0
+        elif phase in ("b", "e"):
+            key = (event.get("pid"), event.get("cat"), event.get("name"), event.get("id"))
+            if phase == "b":
+                begun[key].append(event)
+            elif begun[key]:
+                begin = begun[key].pop()
+                args = {**begin.get("args", {}), **event.get("args", {})}
+                yield begin.get("name"), args, (event.get("ts", 0) - begin.get("ts", 0)) / 1000.0
+
+
+def aggregate(build_folder: Path) -> Dict[str, Dict[str, Dict[str, float]]]:
+    report = {"translation_units": {}, "headers": defaultdict(lambda: {"ms": 0.0, "count": 0}),
+              "templates": defaultdict(lambda: {"ms": 0.0, "count": 0})}
+
+    for trace_file, trace in load_traces(build_folder):
+        translation_unit = trace_file.relative_to(build_folder).with_suffix("").as_posix()  # <source>.json next to the object
+        for name, args, duration in durations(trace["traceEvents"]):
+            if name == "ExecuteCompiler":
+                report["translation_units"][translation_unit] = {"ms": duration, "count": 1}
+            elif name in CATEGORIES:
+                entry = report[CATEGORIES[name]][args.get("detail", "<unknown>")]
+                entry["ms"] += duration
+                entry["count"] += 1
+    return report
+
+
+def ranked(entries: Dict[str, Dict[str, float]], top: int):
+    return sorted(entries.items(), key = lambda item: item[1]["ms"], reverse = True)[:top]
+
+
+def print_report(report: Dict[str, Dict[str, Dict[str, float]]], top: int) -> None:
+    for category, title in [("translation_units", "Translation units"), ("headers", "Headers (inclusive parse time)"),
+                            ("templates", "Template instantiations")]:
+        print(f"\n{title}:")
+        for name, entry in ranked(report[category], top):
+            print(f"  {entry['ms']:>10.1f} ms  {entry['count']:>6}x  {name}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("build_folder", type = Path)
+    parser.add_argument("--top", type = int, default = 20, help = "number of entries per category")
+    parser.add_argument("--json", type = Path, help = "also write the ranked report to this JSON file")
+    args = parser.parse_args()
+
+    report = aggregate(args.build_folder.resolve())
+    if not report["translation_units"]:
+        parser.exit(1, f"No -ftime-trace files found in {args.build_folder}\n")
+
+    print_report(report, args.top)
+    if args.json:
+        args.json.write_text(json.dumps({category: [{"name": name, **entry} for name, entry in ranked(entries, args.top)]
+                                         for category, entries in report.items()}, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
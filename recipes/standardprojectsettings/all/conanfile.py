@@ -3,19 +3,47 @@ from os import path
 from conan import ConanFile
 from conan.tools.files import copy
 
+required_conan_version = ">=2.7.0"
+
 
 class Pkg(ConanFile):
     name = "standardprojectsettings"
-    exports_sources = "StandardProjectSettings.cmake"
+    exports_sources = "StandardProjectSettings.cmake", "build_time_report.py"
     package_type = "build-scripts"
+    options = {
+        "lto": [True, False],
+        "pgo_mode": ["off", "generate", "use"],
+        "pgo_profile_dir": [None, "ANY"],
+    }
+    default_options = {
+        "lto": False,
+        "pgo_mode": "off",
+        "pgo_profile_dir": None,
+    }
+
+    def package_id(self):
+        # The options only set CMake variables for the consumers, the packaged CMake module is always the same
+        self.info.clear()
 
     def package(self):
         copy(self, "StandardProjectSettings.cmake", src = self.export_sources_folder, dst = path.join(self.package_folder, "res", "cmake"))
+        copy(self, "build_time_report.py", src = self.export_sources_folder, dst = path.join(self.package_folder, "bin"))
 
     def package_info(self):
         self.cpp_info.includedirs = []
         self.cpp_info.libdirs = []
-        self.cpp_info.bindirs = []
+        self.cpp_info.bindirs = ["bin"]
 
         self.cpp_info.set_property("name", "standardprojectsettings")
         self.cpp_info.set_property("cmake_build_modules", [path.join("res", "cmake", "StandardProjectSettings.cmake")])
+
+        # Switches for enable_lto() and enable_pgo() in the consumers
+        cmake_variables = {}
+        if self.options.lto:
+            cmake_variables["ENABLE_LTO"] = "ON"
+        if self.options.pgo_mode != "off":
+            cmake_variables["PGO_MODE"] = str(self.options.pgo_mode)
+            if self.options.pgo_profile_dir:
+                cmake_variables["PGO_PROFILE_DIR"] = str(self.options.pgo_profile_dir).replace("\\", "/")
+        if cmake_variables:
+            self.conf_info.update("tools.cmake.cmaketoolchain:extra_variables", cmake_variables)
@@ -1,12 +1,18 @@
 from pathlib import Path
 import json
+import re
 import time
 import collections
-from typing import List, Any, Set
+from typing import List, Any, Set, Optional
 
 from conan import ConanFile
 from conan.tools.files import save, load, rm
 
+try:
+    import orjson as fast_json  # Optional, parses the large definition files considerably faster
+except ImportError:
+    fast_json = None
+
 
 # Part of this script generates a POT file from a JSON settings file. It
 # has been adapted from createjsoncontext.py of KDE's translation
@@ -14,6 +20,9 @@ from conan.tools.files import save, load, rm
 # the JSON file using the structure as used by Uranium settings files.
 # Copyright 2014  Burkhard Lück <lueck@hube-lueck.de>
 
+# Matches an (unescaped) "inherits" key, used to pre-screen definition files without parsing them
+INHERITS_KEY_PATTERN = re.compile(rb'(?<!\\)"inherits"\s*:')
+
 
 class ExtractTranslations(object):
     def __init__(self, conanfile: ConanFile):
@@ -146,15 +155,30 @@ class ExtractTranslations(object):
     def _extract_settings(self) -> None:
         """ Extract strings from settings json files to pot file with a matching name """
         setting_json_paths = [path for path in Path(self._conanfile.source_folder).rglob("*.def.json") if "test" not in str(path)]
-        setting_json_data = []
-        for json_path in setting_json_paths:
-            setting_dict = json.loads(load(self._conanfile, json_path), object_pairs_hook = collections.OrderedDict)
-            setting_json_data.append((json_path, setting_dict))
+        setting_json_data = [(json_path, self._load_setting_json(json_path)) for json_path in setting_json_paths]
+        setting_json_data = [(json_path, setting_dict) for json_path, setting_dict in setting_json_data if setting_dict is not None]
 
         variants_names = self._extract_variants_names(setting_json_data)
         for json_path, setting_dict in setting_json_data:
             self._write_setting_text(json_path, setting_dict, self._translations_root_path, variants_names)
 
+    @staticmethod
+    def _parse_json(content: bytes) -> dict[str, Any]:
+        """ Parses json content, preserving the order of the keys """
+        if fast_json is not None:
+            return fast_json.loads(content)  # Plain dicts keep the insertion order
+        return json.loads(content, object_pairs_hook = collections.OrderedDict)
+
+    def _load_setting_json(self, json_path: Path) -> Optional[dict[str, Any]]:
+        """
+        Loads a settings json file. Definitions that inherit from another one don't contain settings to translate, they
+        are only needed when they declare a translatable variants name, otherwise they are skipped without parsing them.
+        """
+        content = json_path.read_bytes()
+        if INHERITS_KEY_PATTERN.search(content) and b"variants_name_has_translation" not in content:
+            return None
+        return self._parse_json(content)
+
     def _extract_variants_names(self, setting_json_data: List[tuple[Path, dict[str, Any]]]) -> Set[str]:
         """ Extract all existing variants from settings json files """
         variants_names = set()